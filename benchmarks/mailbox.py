@@ -0,0 +1,102 @@
+import random
+from email.message import EmailMessage
+from email.utils import formatdate
+
+# (share of the mailbox, approximate body size in bytes)
+DEFAULT_SIZE_MIX = ((0.6, 1_000), (0.3, 10_000), (0.1, 100_000))
+
+# messages start at this date (2025-01-01) and arrive one every 7 minutes, so the dates are reproducible
+START_TIMESTAMP = 1735689600
+
+WORDS = (
+    "invoice payment order meeting project update report review approval request ticket support account "
+    "shipping delivery schedule budget team client contract deadline release server backup policy travel "
+    "booking flight hotel expense receipt renewal subscription newsletter offer discount event registration "
+    "please confirm attached details below thanks regards tomorrow today week monday friday quarter status"
+).split()
+
+SENDERS = (
+    "billing@vendor.example", "alice@example.com", "bob@example.org", "noreply@shop.example",
+    "support@helpdesk.example", "news@digest.example", "calendar@example.com", "carol@example.net",
+)
+
+def sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 16))]
+    return " ".join(words).capitalize() + "."
+
+def paragraphs(rng, size):
+    """Filler text of roughly size bytes, in paragraphs of a few sentences."""
+    text = []
+    length = 0
+    while length < size:
+        paragraph = " ".join(sentence(rng) for _ in range(rng.randint(2, 5)))
+        text.append(paragraph)
+        length += len(paragraph) + 2
+    return text
+
+def html_body(text):
+    cells = "".join(f"<tr><td style=\"padding:4px\"><p>{paragraph}</p></td></tr>" for paragraph in text)
+    return (
+        "<html><head><style>td { font-family: Arial; }</style></head><body>"
+        f"<table width=\"600\">{cells}</table><div>Unsubscribe | View in browser</div></body></html>"
+    )
+
+def generate_mailbox(count, seed=0, size_mix=DEFAULT_SIZE_MIX, html_ratio=0.4, attachment_ratio=0.15,
+                     thread_ratio=0.3, newsletter_ratio=0.2):
+    """Builds count raw RFC822 messages, the same ones for the same arguments.
+
+    The body sizes follow size_mix; html_ratio of the messages are HTML (half of them with a plain
+    alternative), attachment_ratio carry a PDF or calendar attachment, thread_ratio are replies quoting
+    an earlier message (In-Reply-To/References), and newsletter_ratio have List-Unsubscribe headers.
+    """
+    rng = random.Random(seed)
+    shares, sizes = zip(*size_mix)
+    messages = []
+    sent = []
+    for number in range(count):
+        size = rng.choices(sizes, weights=shares)[0]
+        text = paragraphs(rng, rng.randint(size // 2, size))
+        msg = EmailMessage()
+        msg["From"] = rng.choice(SENDERS)
+        msg["To"] = "user@example.com"
+        msg["Date"] = formatdate(START_TIMESTAMP + number * 420)
+        message_id = f"<bench-{seed}-{number}@example.com>"
+        msg["Message-ID"] = message_id
+        subject = sentence(rng)[:60].rstrip(".")
+
+        if sent and rng.random() < thread_ratio:
+            parent_id, parent_subject, parent_text, parent_references = rng.choice(sent)
+            subject = f"Re: {parent_subject}"
+            msg["In-Reply-To"] = parent_id
+            msg["References"] = " ".join(parent_references + [parent_id])
+            quoted = "\n".join(f"> {line}" for line in parent_text[:3])
+            text = text[:2] + [f"On {formatdate(START_TIMESTAMP)} someone wrote:", quoted]
+            references = parent_references + [parent_id]
+        else:
+            references = []
+        if rng.random() < newsletter_ratio:
+            msg["List-Unsubscribe"] = "<mailto:unsubscribe@digest.example>"
+            msg["Precedence"] = "bulk"
+        msg["Subject"] = subject
+
+        plain = "\n\n".join(text) + "\n\n-- \nSent from my phone\n"
+        if rng.random() < html_ratio:
+            if rng.random() < 0.5:
+                msg.set_content(plain)
+                msg.add_alternative(html_body(text), subtype="html")
+            else:
+                msg.set_content(html_body(text), subtype="html")
+        else:
+            msg.set_content(plain)
+
+        if rng.random() < attachment_ratio:
+            if rng.random() < 0.5:
+                data = bytes(rng.getrandbits(8) for _ in range(rng.randint(20_000, 200_000)))
+                msg.add_attachment(data, maintype="application", subtype="pdf", filename=f"invoice_{number}.pdf")
+            else:
+                calendar = f"BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nSUMMARY:{subject}\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n"
+                msg.add_attachment(calendar.encode(), maintype="text", subtype="calendar", filename="invite.ics")
+
+        messages.append(msg.as_bytes(policy=msg.policy.clone(linesep="\r\n")))
+        sent.append((message_id, subject, text, references))
+    return messages
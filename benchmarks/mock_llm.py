@@ -0,0 +1,65 @@
+import hashlib
+import json
+import threading
+import time
+from utils.tokens import estimate_tokens
+from utils.prompts import GEMINI_PROMPT
+
+TAGS = (
+    "Invoice", "Order Confirmation", "Payments", "Meeting Invite/Calendar Invite", "Newsletter",
+    "Promotional / Marketing / Advertisement", "Support Ticket Update", "Travel", "For review",
+)
+
+class MockBackend:
+    """Deterministic stand-in for the Gemini/Ollama backends, with a simulated latency and token accounting.
+
+    The tags and summary are derived from a hash of the email, so the same email always gets the same
+    answer. A request sleeps latency seconds plus seconds_per_token for every prompt and output token,
+    and every fail_every-th request raises a TimeoutError to exercise the retries.
+    """
+
+    def __init__(self, latency=0.05, seconds_per_token=0.0, fail_every=0, prompt=GEMINI_PROMPT):
+        self.model_name = "mock"
+        self.prompt = prompt
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self.fail_every = fail_every
+        self.stats = {"requests": 0, "emails": 0, "prompt_tokens": 0, "output_tokens": 0, "errors": 0}
+        self.request_times = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def answer(email_data):
+        digest = hashlib.sha256(json.dumps(email_data, sort_keys=True, default=str).encode()).digest()
+        tags = [TAGS[digest[0] % len(TAGS)]]
+        if digest[1] % 4 == 0:
+            tags.append("Urgent/High priority")
+        return {"tags": tags, "summary": f"{(email_data.get('subject') or 'Email')[:80]} needs a look."}
+
+    def _respond(self, email_data, results):
+        start = time.perf_counter()
+        with self.lock:
+            self.stats["requests"] += 1
+            request_number = self.stats["requests"]
+        if self.fail_every and request_number % self.fail_every == 0:
+            with self.lock:
+                self.stats["errors"] += 1
+            time.sleep(self.latency)
+            raise TimeoutError("simulated model timeout")
+
+        prompt_tokens = estimate_tokens(self.prompt.format(email_data=email_data))
+        output_tokens = estimate_tokens(json.dumps(results))
+        time.sleep(self.latency + self.seconds_per_token * (prompt_tokens + output_tokens))
+        with self.lock:
+            self.stats["emails"] += len(results) if isinstance(results, list) else 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["output_tokens"] += output_tokens
+            self.request_times.append((start, time.perf_counter(), len(results) if isinstance(results, list) else 1))
+        return results
+
+    def classify(self, email_data):
+        return self._respond(email_data, self.answer(email_data))
+
+    def classify_batch(self, batch):
+        results = [{"id": email_id, **self.answer(email_data)} for email_id, email_data in batch]
+        return self._respond(json.dumps([{"id": i, **e} for i, e in batch], default=str), results)
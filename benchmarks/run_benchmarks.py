@@ -0,0 +1,278 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from benchmarks.mailbox import generate_mailbox
+from benchmarks.mock_llm import MockBackend
+from utils.fake_imap_server import FakeIMAPServer
+from utils.telemetry import setup_logging
+from utils.tokens import estimate_tokens
+from utils.llm_engine import ClassificationEngine, prompt_data
+from utils.normalize import EmailNormalizer
+from utils.store_emails import store_emails_data
+from utils.email_store import EmailStore
+from utils.sync_coordinator import SyncCoordinator
+from imap import fetch_all_emails, iter_emails, parse_email
+
+# throughput drop (fraction) reported as a regression by --baseline
+REGRESSION_TOLERANCE = 0.2
+
+def rss_mb():
+    """Current resident set size, from /proc on Linux and the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def email_tokens(emails):
+    return sum(estimate_tokens(prompt_data(email_data)) for email_data in emails)
+
+def classified_latencies(backend):
+    """Per-email latency of a classification: the duration of the request the email was sent in."""
+    return [end - begin for begin, end, count in backend.request_times for _ in range(count)]
+
+# every stage gets the prepared inputs and returns (emails processed, per-email latencies in seconds, tokens)
+# - fetch stages: time from the stage start until the email is available
+# - CPU stages: processing time of the email
+# - classify: duration of the request the email was sent in
+# tokens are those of the emails leaving the stage, or the prompt + output tokens for classify
+
+def stage_fetch_all_emails(inputs, args):
+    start = time.perf_counter()
+    emails = fetch_all_emails(account=inputs["account"])
+    elapsed = time.perf_counter() - start
+    return len(emails), [elapsed] * len(emails), email_tokens(emails)
+
+def stage_iter_emails(inputs, args):
+    start = time.perf_counter()
+    latencies, tokens = [], 0
+    for email_data in iter_emails(account=inputs["account"]):
+        latencies.append(time.perf_counter() - start)
+        tokens += estimate_tokens(prompt_data(email_data))
+    return len(latencies), latencies, tokens
+
+def stage_parse_email(inputs, args):
+    latencies, tokens = [], 0
+    for raw in inputs["raw"]:
+        start = time.perf_counter()
+        email_data = parse_email(raw)
+        latencies.append(time.perf_counter() - start)
+        tokens += estimate_tokens(prompt_data(email_data))
+    return len(latencies), latencies, tokens
+
+def stage_normalize(inputs, args):
+    normalizer = EmailNormalizer()
+    latencies, tokens = [], 0
+    for email_data in inputs["parsed"]:
+        start = time.perf_counter()
+        email_data = normalizer.normalize(email_data)
+        latencies.append(time.perf_counter() - start)
+        tokens += estimate_tokens(prompt_data(email_data))
+    return len(latencies), latencies, tokens
+
+def make_engine(args):
+    backend = MockBackend(latency=args.latency, seconds_per_token=args.seconds_per_token, fail_every=args.fail_every)
+    engine = ClassificationEngine(
+        backend, concurrency=args.concurrency, batch_tokens=args.batch_tokens, backoff=0.01
+    )
+    return backend, engine
+
+def stage_classify(inputs, args):
+    backend, engine = make_engine(args)
+    processed = engine.classify_all(inputs["normalized"])
+    return len(processed), classified_latencies(backend), engine.stats["prompt_tokens"] + engine.stats["output_tokens"]
+
+def stage_store_emails_data(inputs, args):
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        store_emails_data(inputs["classified"], output_folder=folder)
+        elapsed = time.perf_counter() - start
+    count = len(inputs["classified"])
+    return count, [elapsed / count] * count if count else [], email_tokens(inputs["classified"])
+
+def stage_email_store(inputs, args):
+    with tempfile.TemporaryDirectory() as folder:
+        store = EmailStore(os.path.join(folder, "emails.sqlite3"))
+        start = time.perf_counter()
+        store.store(inputs["classified"])
+        elapsed = time.perf_counter() - start
+    count = len(inputs["classified"])
+    return count, [elapsed / count] * count if count else [], email_tokens(inputs["classified"])
+
+def stage_end_to_end(inputs, args):
+    """Sync, normalize, thread, classify and store, like the parse scripts."""
+    backend, engine = make_engine(args)
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        store = EmailStore(os.path.join(folder, "emails.sqlite3"))
+        coordinator = SyncCoordinator([inputs["account"]], parse_processes=args.parse_processes)
+        normalizer = EmailNormalizer()
+        emails = map(store.annotate_thread, map(normalizer.normalize, coordinator.iter_emails()))
+        processed = engine.classify_all(emails)
+        store.store(processed)
+        coordinator.close()
+    # the time from the start until the email is classified
+    latencies = [end - start for _, end, count in backend.request_times for _ in range(count)]
+    return len(processed), latencies, engine.stats["prompt_tokens"] + engine.stats["output_tokens"]
+
+STAGES = {
+    "fetch_all_emails": stage_fetch_all_emails,
+    "iter_emails": stage_iter_emails,
+    "parse_email": stage_parse_email,
+    "normalize": stage_normalize,
+    "classify": stage_classify,
+    "store_emails_data": stage_store_emails_data,
+    "email_store": stage_email_store,
+    "end_to_end": stage_end_to_end,
+}
+
+def run_stage(name, inputs, args, connection):
+    """Runs a stage in a forked process, so its peak RSS is not hidden by the stages before it."""
+    baseline = rss_mb()
+    if args.verbose:
+        setup_logging()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        start = time.perf_counter()
+        count, latencies, tokens = STAGES[name](inputs, args)
+        elapsed = time.perf_counter() - start
+    connection.send({
+        "stage": name,
+        "emails": count,
+        "seconds": elapsed,
+        "emails_per_second": count / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": max(0.0, peak_rss_mb() - baseline),
+        "tokens_per_email": tokens / count if count else 0.0,
+    })
+    connection.close()
+
+def prepare(args, server):
+    """Builds the mailbox and the input of every stage once, outside of the measurements."""
+    raw = generate_mailbox(
+        args.emails, seed=args.seed, html_ratio=args.html_ratio, attachment_ratio=args.attachment_ratio,
+        thread_ratio=args.thread_ratio,
+    )
+    for message in raw:
+        server.append(message)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        parsed = [parse_email(message) for message in raw]
+        normalizer = EmailNormalizer()
+        normalized = [normalizer.normalize(dict(email_data)) for email_data in parsed]
+        instant = argparse.Namespace(**{**vars(args), "latency": 0.0, "seconds_per_token": 0.0, "fail_every": 0})
+        classified = make_engine(instant)[1].classify_all(normalized)
+    return {
+        "account": server.account(),
+        "raw": raw,
+        "parsed": parsed,
+        "normalized": normalized,
+        "classified": classified,
+        "mailbox_mb": sum(len(message) for message in raw) / 2**20,
+    }
+
+def print_report(results, mailbox_mb, baseline=None):
+    print(f"\nMailbox: {mailbox_mb:.1f} MB")
+    header = f"{'stage':<18}{'emails':>7}{'seconds':>9}{'emails/s':>10}{'p50 ms':>9}{'p99 ms':>9}" \
+             f"{'peak MB':>9}{'+MB':>7}{'trips':>7}{'tok/email':>10}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['stage']:<18}{result['emails']:>7}{result['seconds']:>9.2f}{result['emails_per_second']:>10.1f}"
+            f"{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['peak_rss_mb']:>9.1f}"
+            f"{result['rss_growth_mb']:>7.1f}{result['round_trips']:>7}{result['tokens_per_email']:>10.1f}"
+        )
+
+    regressions = []
+    if baseline:
+        previous = {result["stage"]: result for result in baseline["results"]}
+        print("\nCompared with the baseline:")
+        for result in results:
+            before = previous.get(result["stage"])
+            if not before or not before["emails_per_second"]:
+                continue
+            change = result["emails_per_second"] / before["emails_per_second"] - 1
+            flag = "❌ regression" if change < -REGRESSION_TOLERANCE else "✅"
+            if change < -REGRESSION_TOLERANCE:
+                regressions.append(result["stage"])
+            print(f"{result['stage']:<18}{change:>+8.0%} throughput, {result['round_trips'] - before['round_trips']:+d} round trips  {flag}")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the email pipeline against a synthetic mailbox")
+    arg_parser.add_argument("--emails", type=int, default=300)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--html-ratio", type=float, default=0.4)
+    arg_parser.add_argument("--attachment-ratio", type=float, default=0.15)
+    arg_parser.add_argument("--thread-ratio", type=float, default=0.3)
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="seconds per mock model request")
+    arg_parser.add_argument("--seconds-per-token", type=float, default=0.0)
+    arg_parser.add_argument("--fail-every", type=int, default=0, help="every Nth model request times out")
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--batch-tokens", type=int, default=0)
+    arg_parser.add_argument("--parse-processes", type=int, default=0)
+    arg_parser.add_argument("--stages", default=",".join(STAGES), help="comma separated, default all")
+    arg_parser.add_argument("--output", help="write the results as JSON")
+    arg_parser.add_argument("--baseline", help="JSON of an earlier run, exits with 1 on a throughput regression")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the output of the pipeline")
+    args = arg_parser.parse_args()
+
+    server = FakeIMAPServer()
+    server.start()
+    inputs = prepare(args, server)
+    context = multiprocessing.get_context("fork")
+
+    results = []
+    for name in args.stages.split(","):
+        commands = server.stats["commands"]
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_stage, args=(name, inputs, args, sender))
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            print(f"❌ {name} failed, see the traceback above")
+            continue
+        finally:
+            process.join()
+        result["round_trips"] = server.stats["commands"] - commands
+        results.append(result)
+        print(f"✅ {name}: {result['emails_per_second']:.1f} emails/s")
+    server.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = print_report(results, inputs["mailbox_mb"], baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,362 @@
 import os
+import re
+import time
 import imaplib
 import email
-from email.header import decode_header
+import logging
 from dotenv import load_dotenv
+from utils.telemetry import metrics, record_span, span
+from utils.imap_parse import parse_fetch_response, walk_bodystructure, find_text_part, decode_part, decode_text
+from utils.mime_stream import MimeStreamParser, MIME_MAX_MESSAGE_BYTES, MIME_TEXT_BYTES
+from utils.normalize import decode_header_value
 
-def fetch_all_emails():
+# number of messages requested per UID FETCH command
+BATCH_SIZE = int(os.getenv("IMAP_BATCH_SIZE", 500))
+
+# number of bytes of the text body downloaded per message by iter_emails
+BODY_LIMIT = int(os.getenv("IMAP_BODY_LIMIT", 32768))
+
+# bytes downloaded per FETCH by fetch_all_emails: small messages are grouped up to it, larger ones
+# are downloaded in partial fetches of this size and parsed as they arrive
+FETCH_CHUNK_BYTES = int(os.getenv("IMAP_FETCH_CHUNK_BYTES", 4 * 1024 * 1024))
+
+# headers fetched by iter_emails before any body is downloaded
+HEADER_FIELDS = "FROM TO CC BCC SUBJECT DATE MESSAGE-ID IN-REPLY-TO REFERENCES LIST-UNSUBSCRIBE PRECEDENCE"
+
+logger = logging.getLogger(__name__)
+
+class RoundTripCounter:
+    """Mixin for imaplib connections that counts the commands (network round trips) they send."""
+    round_trips = 0
+
+    def _command(self, name, *args):
+        self.round_trips += 1
+        metrics.count("email_imap_commands_total", command=name)
+        return super()._command(name, *args)
+
+class CountingIMAP4_SSL(RoundTripCounter, imaplib.IMAP4_SSL):
+    """IMAP4_SSL connection that counts its round trips."""
+
+class CountingIMAP4(RoundTripCounter, imaplib.IMAP4):
+    """Plain-text IMAP4 connection that counts its round trips, for local servers ("ssl": false)."""
+
+def uid_sequence_set(uids):
+    """Compresses a list of UIDs into an IMAP sequence set, e.g. [1, 2, 3, 7] --> "1:3,7"."""
+    uids = sorted(int(uid) for uid in uids)
+    ranges = []
+    for uid in uids:
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+def decode_headers(msg):
+    """Decodes the address and subject headers of a parsed message, with every RFC 2047 fragment."""
+    return {
+        "to": decode_header_value(msg.get("To", "")),
+        "from": decode_header_value(msg.get("From", "")),
+        "cc": decode_header_value(msg.get("Cc", "N/A")),
+        "bcc": decode_header_value(msg.get("Bcc", "N/A")),
+        "subject": decode_header_value(msg.get("Subject", ""))
+    }
+
+def message_meta(msg, parts, uid=None, body_type=None):
+    """Collects what is needed besides the text: ids for storage, bulk-mail headers and the MIME parts.
+
+    It is kept under the "meta" key of an email, which is never sent to the model. The fetch functions add
+    the account, folder and UIDVALIDITY the email came from (see with_source).
+    """
+    return {
+        "uid": uid,
+        "message_id": (msg.get("Message-ID") or "").strip() or None,
+        "date": msg.get("Date"),
+        "in_reply_to": next(iter(re.findall(r"<[^>]+>", str(msg.get("In-Reply-To") or ""))), None),
+        "references": re.findall(r"<[^>]+>", str(msg.get("References") or "")),
+        "body_type": body_type,
+        "list_unsubscribe": msg.get("List-Unsubscribe"),
+        "precedence": msg.get("Precedence"),
+        # the hash is only known when the whole message is parsed (fetch_all_emails), iter_emails takes
+        # the parts from BODYSTRUCTURE without downloading the attachments, so it is None there
+        "parts": [
+            {"content_type": p["content_type"], "filename": p["filename"], "size": p["size"], "sha256": p.get("sha256")}
+            for p in parts
+        ],
+    }
+
+def with_source(emails, account, folder, uidvalidity):
+    """Records in the meta of the emails where they were fetched from, so a failed one can be fetched again."""
+    for email_data in emails:
+        email_data["meta"].update(account=account_key(account), folder=folder, uidvalidity=uidvalidity)
+    return emails
+
+def parse_email(raw_email):
+    """Decodes the headers and the first text body of a raw RFC822 message."""
+    return parse_email_chunks([raw_email])
+
+def parse_email_chunks(chunks):
+    """Decodes a message streamed as byte chunks with bounded memory (see utils/mime_stream.py).
+
+    Parts are decoded as they arrive and only the text body is kept, spooled to a temporary file when
+    large; attachments are reduced to their metadata (type, name, size, SHA-256).
+    """
+    parser = MimeStreamParser()
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+        text_part = parser.text_part()
+        body = decode_text(text_part.read(MIME_TEXT_BYTES), text_part.charset) if text_part else ""
+        body_type = text_part.content_type if text_part else parser.headers.get_content_type()
+        parts = [part.metadata() for part in parser.parts]
+        return {**decode_headers(parser.headers), "body": body, "meta": message_meta(parser.headers, parts, body_type=body_type)}
+    finally:
+        parser.cleanup()
+
+def search_new_uids(mail, account, folder, sync_state=None):
+    """Returns the UIDs of the unseen emails to fetch from the selected folder, and its UIDVALIDITY."""
+    # resume after the last processed UID, unless the server renumbered the folder (UIDVALIDITY changed)
+    uidvalidity = int(mail.response("UIDVALIDITY")[1][0] or 0)
+    last_uid = sync_state.last_uid(account, folder, uidvalidity) if sync_state is not None else 0
+
+    # search for all emails(read and unread)
+    # in the search we can modify it by changing it from ALL --> complete inbox, UNSEEN --> new/unread emails
+    # UIDs are used instead of sequence numbers so the ids stay valid across commands
+    if last_uid:
+        status, messages = mail.uid("SEARCH", None, f"UID {last_uid + 1}:*", "UNSEEN")
+    else:
+        status, messages = mail.uid("SEARCH", None, "UNSEEN")
+    # "n:*" always matches the highest UID, even when it is below n
+    return [uid for uid in messages[0].split() if int(uid) > last_uid], uidvalidity
+
+def env_account():
+    """The account configured in the env (EMAIL_USER, EMAIL_PASSWORD, IMAP_HOST, IMAP_PORT, IMAP_SSL)."""
     # load env
     load_dotenv()
 
-    # IMAP config
-    EMAIL_USER = os.getenv("EMAIL_USER")
-    EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-    IMAP_HOST = os.getenv("IMAP_HOST")
-    IMAP_PORT = int(os.getenv("IMAP_PORT", 993))
+    return {
+        "user": os.getenv("EMAIL_USER"),
+        "password": os.getenv("EMAIL_PASSWORD"),
+        "host": os.getenv("IMAP_HOST"),
+        "port": int(os.getenv("IMAP_PORT", 993)),
+        "ssl": os.getenv("IMAP_SSL", "true").lower() != "false",
+    }
+
+def account_key(account):
+    """Identifies an account in the sync state, e.g. "user@example.com@imap.example.com"."""
+    return f"{account['user']}@{account['host']}"
+
+def connect(account):
+    """Opens an authenticated IMAP connection to an account."""
+    if account.get("ssl", True):
+        mail = CountingIMAP4_SSL(account["host"], account.get("port", 993))
+    else:
+        mail = CountingIMAP4(account["host"], account.get("port", 143))
+    mail.login(account["user"], account["password"])
+    return mail
+
+def fetch_all_emails(batch_size=BATCH_SIZE, sync_state=None, folder="INBOX", account=None, parse_pool=None):
+    """Fetches the unseen emails of a folder.
+
+    When a SyncState is passed only messages above the stored UID high-water mark are fetched,
+    and the new mark is recorded in it (the caller saves it once the emails are processed, after
+    SyncState.hold_back moved it below the emails that failed).
+    With a process pool, the MIME parsing runs in its worker processes.
+    """
+    account = account or env_account()
 
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT)
-        mail.login(EMAIL_USER, EMAIL_PASSWORD)
-        mail.select("INBOX")
+        mail = connect(account)
+        mail.select(folder)
         
-        # search for all emails(read and unread)
-        # in the search we can modify it by changing it from ALL --> complete inbox, UNSEEN --> new/unread emails
-        status, messages = mail.search(None, "UNSEEN")
-        email_ids = messages[0].split()
+        with span("fetch"):
+            email_uids, uidvalidity = search_new_uids(mail, account_key(account), folder, sync_state)
         
-        # empty list for storing all the emails
         emails = []
         
-        for e_id in email_ids:
-            status, msg_data = mail.fetch(e_id, "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-                    
-                    # Decode email headers
-                    subject, encoding = decode_header(msg["Subject"])[0]
-                    if isinstance(subject, bytes):
-                        subject = subject.decode(encoding if encoding else "utf-8")
-                    
-                    from_email, encoding = decode_header(msg.get("From"))[0]
-                    if isinstance(from_email, bytes):
-                        from_email = from_email.decode(encoding if encoding else "utf-8")
-                    
-                    to_email, encoding = decode_header(msg.get("To"))[0]
-                    if isinstance(to_email, bytes):
-                        to_email = to_email.decode(encoding if encoding else "utf-8")
-                    
-                    cc_email = msg.get("Cc", "N/A")
-                    bcc_email = msg.get("Bcc", "N/A")
-                    
-                    body = ""
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            content_type = part.get_content_type()
-                            content_disposition = str(part.get("Content-Disposition"))
-                            if "attachment" not in content_disposition:
-                                try:
-                                    body = part.get_payload(decode=True).decode()
-                                    break
-                                except:
-                                    continue
-                    else:
-                        body = msg.get_payload(decode=True).decode()
-                    
-                    emails.append({
-                        "to": to_email,
-                        "from": from_email,
-                        "cc": cc_email,
-                        "bcc": bcc_email,
-                        "subject": subject,
-                        "body": body
-                    })
-            # mark the email as unseen
-            mail.store(e_id, '-FLAGS', '\\Seen')
+        # fetch the messages in chunks of UIDs, sizes first so no FETCH returns more than FETCH_CHUNK_BYTES.
+        # BODY.PEEK[] does not set the \Seen flag, so no STORE is needed to mark them unseen again
+        for start in range(0, len(email_uids), batch_size):
+            uid_set = uid_sequence_set(email_uids[start:start + batch_size])
+            with span("fetch"):
+                status, size_data = mail.uid("FETCH", uid_set, "(UID RFC822.SIZE)")
+            sizes = {int(m["UID"]): int(m["RFC822.SIZE"]) for m in parse_fetch_response(size_data)}
+        
+            group, group_bytes = [], 0
+            for uid in sorted(sizes):
+                if group and (group_bytes + sizes[uid] > FETCH_CHUNK_BYTES or sizes[uid] > FETCH_CHUNK_BYTES):
+                    emails.extend(fetch_group(mail, group, parse_pool))
+                    group, group_bytes = [], 0
+                if sizes[uid] > FETCH_CHUNK_BYTES:
+                    email_data = parse_email_chunks(iter_message_chunks(mail, uid, sizes[uid]))
+                    email_data["meta"]["uid"] = uid
+                    emails.append(email_data)
+                else:
+                    group.append(uid)
+                    group_bytes += sizes[uid]
+            if group:
+                emails.extend(fetch_group(mail, group, parse_pool))
+        
+        with_source(emails, account, folder, uidvalidity)
+        if sync_state is not None and email_uids:
+            sync_state.update(account_key(account), folder, uidvalidity, max(int(uid) for uid in email_uids))
         
         # close the mail connection and logout
         mail.close()
         mail.logout()
         
+        logger.info(f"IMAP round trips: {mail.round_trips} for {len(emails)} emails")
         return emails
     except Exception as e:
-        print(f"❌ Error fetching emails: {e}")
+        logger.error(f"❌ Error fetching emails: {e}")
         return []
 
+def fetch_group(mail, uids, parse_pool=None):
+    """Downloads a group of small messages with one FETCH and parses them, in the pool when there is one."""
+    with span("fetch", emails=len(uids)):
+        status, msg_data = mail.uid("FETCH", uid_sequence_set(uids), "(UID BODY.PEEK[])")
+    messages = parse_fetch_response(msg_data)
+    raw_emails = [message.get("BODY[]") or b"" for message in messages]
+    with span("decode", emails=len(raw_emails)):
+        emails = list(parse_pool.map(parse_email, raw_emails, chunksize=16) if parse_pool else map(parse_email, raw_emails))
+    for message, email_data in zip(messages, emails):
+        email_data["meta"]["uid"] = int(message["UID"])
+    return emails
+
+def iter_message_chunks(mail, uid, size, chunk_bytes=FETCH_CHUNK_BYTES, max_bytes=MIME_MAX_MESSAGE_BYTES):
+    """Downloads a large message in partial fetches, yielding its bytes chunk by chunk up to max_bytes."""
+    offset = 0
+    while offset < min(size, max_bytes):
+        length = min(chunk_bytes, max_bytes - offset)
+        with span("fetch"):
+            status, msg_data = mail.uid("FETCH", str(uid), f"(UID BODY.PEEK[]<{offset}.{length}>)")
+        messages = parse_fetch_response(msg_data)
+        data = messages[0].get("BODY[]") if messages else None
+        if not data:
+            return
+        yield data
+        offset += len(data)
+
+def download_chunk(mail, chunk, body_limit=BODY_LIMIT):
+    """Downloads the headers, BODYSTRUCTURE and partial text part of a chunk of UIDs, without decoding them.
+
+    Returns one (uid, header bytes, body bytes, text part, parts) tuple per message, for build_emails.
+    """
+    status, msg_data = mail.uid(
+        "FETCH", uid_sequence_set(chunk), f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])"
+    )
+    messages = parse_fetch_response(msg_data)
+
+    # group the messages by the section of their text part, one partial fetch per section
+    all_parts = {}
+    text_parts = {}
+    sections = {}
+    for message in messages:
+        all_parts[message["UID"]] = list(walk_bodystructure(message.get("BODYSTRUCTURE") or []))
+        part = find_text_part(all_parts[message["UID"]])
+        if part:
+            text_parts[message["UID"]] = part
+            sections.setdefault(part["section"], []).append(message["UID"])
+
+    bodies = {}
+    for section, uids in sections.items():
+        status, body_data = mail.uid(
+            "FETCH", uid_sequence_set(uids), f"(UID BODY.PEEK[{section}]<0.{body_limit}>)"
+        )
+        for body in parse_fetch_response(body_data):
+            bodies[body["UID"]] = body.get(f"BODY[{section}]") or b""
+
+    return [
+        (
+            int(message["UID"]),
+            next((v for k, v in message.items() if k.startswith("BODY[HEADER.FIELDS")), None),
+            bodies.get(message["UID"], b""),
+            text_parts.get(message["UID"]),
+            all_parts[message["UID"]],
+        )
+        for message in messages
+    ]
+
+def build_emails(fetched):
+    """Decodes the headers and body bytes downloaded by download_chunk into email dicts.
+
+    Top-level so a chunk can be sent to a process pool, away from the thread that waits on the socket.
+    """
+    emails = []
+    for uid, header_bytes, body_bytes, text_part, parts in fetched:
+        headers = email.message_from_bytes(header_bytes or b"")
+        body = decode_part(body_bytes, text_part["encoding"], text_part["charset"]) if text_part else ""
+        emails.append({
+            **decode_headers(headers),
+            "body": body,
+            "meta": message_meta(headers, parts, uid, text_part["content_type"] if text_part else None),
+        })
+    return emails
+
+def build_emails_timed(fetched):
+    """build_emails returning its duration too, so the decode time spent in a pool worker reaches the metrics."""
+    start = time.perf_counter()
+    return build_emails(fetched), time.perf_counter() - start
+
+def iter_emails(batch_size=BATCH_SIZE, sync_state=None, folder="INBOX", body_limit=BODY_LIMIT,
+                mail=None, account=None, parse_pool=None):
+    """Yields the unseen emails of a folder one by one, as they are downloaded.
+
+    For each chunk of UIDs only the headers and BODYSTRUCTURE are fetched first, then the first
+    body_limit bytes of the text part of every message, so attachments are never downloaded.
+    Like fetch_all_emails, a passed SyncState gets the new UID high-water mark recorded in it; emails that
+    fail later on are handed to SyncState.hold_back so the mark is saved below them.
+
+    An open connection can be passed to reuse it (it is left logged in), and with a process pool the
+    decoding of a chunk runs in a worker process while the next chunk is downloaded.
+    """
+    account = account or env_account()
+    own_connection = mail is None
+
+    def hand_out(parsed, last_uid):
+        emails, seconds = parsed.result() if parse_pool else parsed
+        record_span("decode", seconds, emails=len(emails))
+        yield from with_source(emails, account, folder, uidvalidity)
+        if sync_state is not None:
+            sync_state.update(account_key(account), folder, uidvalidity, last_uid)
+        return len(emails)
+
+    count = 0
+    try:
+        if own_connection:
+            mail = connect(account)
+        # a reused connection already counted its earlier commands
+        round_trips = 0 if own_connection else mail.round_trips
+        mail.select(folder)
+
+        with span("fetch"):
+            email_uids, uidvalidity = search_new_uids(mail, account_key(account), folder, sync_state)
+
+        pending = []
+        for start in range(0, len(email_uids), batch_size):
+            chunk = email_uids[start:start + batch_size]
+            with span("fetch", emails=len(chunk)):
+                fetched = download_chunk(mail, chunk, body_limit)
+            parsed = parse_pool.submit(build_emails_timed, fetched) if parse_pool else build_emails_timed(fetched)
+            pending.append((parsed, max(int(uid) for uid in chunk)))
+            # the previous chunk is handed out once this one is downloaded, so decoding overlaps the network
+            while len(pending) > 1:
+                count += yield from hand_out(*pending.pop(0))
+        while pending:
+            count += yield from hand_out(*pending.pop(0))
+
+        # close the mail connection and logout
+        if own_connection:
+            mail.close()
+            mail.logout()
+
+        logger.info(f"IMAP round trips: {mail.round_trips - round_trips} for {count} emails in {account_key(account)}/{folder}")
+    except Exception as e:
+        logger.error(f"❌ Error fetching emails: {e}")
+        if not own_connection:
+            # let the owner of the connection drop it
+            raise
+
 # example 
 if __name__ == "__main__":
     emails = fetch_all_emails()
@@ -0,0 +1,108 @@
+from dotenv import load_dotenv
+
+# the utils read their settings (IMAP_*, EMAIL_STORE_PATH, LLM_CACHE_*...) from the env, so it is loaded before them
+load_dotenv()
+
+from utils.email_store import EmailStore
+from utils.sync_state import SyncState
+from utils.sync_coordinator import SyncCoordinator
+from utils.idle_monitor import MailboxMonitor
+from utils.normalize import EmailNormalizer
+from utils.llm_engine import ClassificationEngine
+from utils.llm_cache import LLMCache
+from utils.preclassifier import PreClassifier, PRECLASSIFIER_TRAINING_EMAILS
+from utils.llm_backends import GeminiBackend, OllamaBackend
+from utils.prompts import GEMINI_PROMPT, OLLAMA_TEMPLATE, EmailInsights
+from utils.telemetry import metrics, setup_logging
+from imap import account_key
+import argparse
+import logging
+import os
+import signal
+import time
+
+logger = logging.getLogger("monitor_emails")
+
+def build_backend(name):
+    """Creates the model backend once, it is kept warm for the lifetime of the daemon."""
+    if name == "gemini":
+        from google import genai
+
+        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+        return GeminiBackend(client, os.getenv("MODEL_NAME"), GEMINI_PROMPT, EmailInsights)
+
+    import ollama
+
+    backend = OllamaBackend(ollama.Client(), "gemma3", OLLAMA_TEMPLATE, EmailInsights)
+    backend.warm_up()
+    return backend
+
+def make_process(coordinator, normalizer, store, engine, sync_state):
+    """Builds the batch handler of the monitor: sync, normalize, thread, classify and store the new mail of some folders.
+
+    iter_emails moves the high-water marks forward as the emails are handed out, so when the batch fails
+    before they are stored (e.g. "database is locked"), the marks are put back and the mail is synced again.
+    """
+    def process(folders):
+        start_time = time.time()
+        snapshot = sync_state.snapshot()
+        fetched = coordinator.iter_emails(folders)
+        try:
+            emails = map(normalizer.normalize, fetched)
+            emails = map(store.annotate_thread, emails)
+            processed_emails = engine.classify_all(emails)
+            store.store(processed_emails)
+            # the high-water marks are only saved once the emails are stored, below the ones that failed
+            for email_data in engine.failed:
+                sync_state.hold_back(email_data["meta"])
+            sync_state.save()
+        except Exception:
+            # stops the sync threads first, so no mark moves after the restore
+            fetched.close()
+            sync_state.restore(snapshot)
+            raise
+        names = ", ".join(f"{account_key(account)}/{folder}" for account, folder in folders)
+        logger.info(f"✅ {len(processed_emails)} new emails from {names} in {time.time() - start_time:.1f}s")
+        metrics.write()
+
+    return process
+
+def main():
+    setup_logging()
+
+    arg_parser = argparse.ArgumentParser(description="Classify and store new emails as they arrive (IMAP IDLE)")
+    arg_parser.add_argument("--backend", choices=["gemini", "ollama"], default="ollama")
+    arg_parser.add_argument("--poll", action="store_true", help="poll with NOOP even when the server supports IDLE")
+    args = arg_parser.parse_args()
+
+    # same pipeline as the one-shot scripts, built once: connections, model, cache and store stay open
+    sync_state = SyncState()
+    store = EmailStore()
+    coordinator = SyncCoordinator(sync_state=sync_state)
+    normalizer = EmailNormalizer()
+    engine = ClassificationEngine(
+        build_backend(args.backend), cache=LLMCache(), preclassifier=PreClassifier(training_emails=store.query(source="model", limit=PRECLASSIFIER_TRAINING_EMAILS))
+    )
+
+    process = make_process(coordinator, normalizer, store, engine, sync_state)
+    monitor = MailboxMonitor(coordinator.accounts, process, poll=args.poll)
+    # metrics are scraped from METRICS_HOST:METRICS_PORT when the port is set, and written to METRICS_FILE after every batch
+    metrics.serve()
+
+    # the first Ctrl-C / SIGTERM finishes the current batch and logs out, a second Ctrl-C exits at once
+    def shutdown(signum, frame):
+        logger.info("Stopping, finishing the current batch...")
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        monitor.stop()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    try:
+        monitor.run()
+    finally:
+        coordinator.close()
+        logger.info("Stopped")
+
+if __name__ == "__main__":
+    main()
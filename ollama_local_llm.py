@@ -1,17 +1,25 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from imap import fetch_unread_emails
 from dotenv import load_dotenv
 
-# load the end
+# load the env, before the utils that read their settings from it
 load_dotenv()
 
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_ollama.llms import OllamaLLM
+from utils.email_store import EmailStore
+import argparse
+
+# number of emails retrieved from the archive for one question
+TOP_K = 10
+
+# characters of each retrieved body put in the prompt
+BODY_CHARS = 2000
+
 # define the required model
 model = OllamaLLM(model="gemma3")
 
 # sample prompt template
 template = """
-You are an expert in analyzing all the email data given to you, 
+You are an expert in analyzing all the email data given to you,
 Your task is to Look into the data given to you and answer the user's question in a formatted way
 
 **User Question** : {user_question}
@@ -22,20 +30,33 @@ Your task is to Look into the data given to you and answer the user's question i
 # pass data to prompt via templete
 prompt = ChatPromptTemplate.from_template(template)
 
-# fetch the emails
-emails = fetch_unread_emails()
+# optional filters on the archive
+arg_parser = argparse.ArgumentParser(description="Ask questions about the stored emails")
+arg_parser.add_argument("--tag", help="only emails with this tag, e.g. Invoice")
+arg_parser.add_argument("--since", help="only emails on or after this date, e.g. 2025-01-01")
+arg_parser.add_argument("--until", help="only emails before this date, e.g. 2025-02-01")
+arg_parser.add_argument("--top-k", type=int, default=TOP_K, help="number of emails given to the model")
+args = arg_parser.parse_args()
+
+user_question = input("Ask question: ")
+
+# retrieve only the most relevant stored emails (BM25 full-text index), so the prompt size
+# does not grow with the archive
+emails = EmailStore().search(user_question, k=args.top_k, tag=args.tag, since=args.since, until=args.until)
 
 # format it
 email_data = "\n\n".join(
-    [f"📧 From: {e['from']}\n📌 Subject: {e['subject']}\n📝 Body: {e['body']}" for e in emails]
-) if emails else "No new emails found."
-
-user_question = input("Ask question: ")
+    [
+        f"📧 From: {e['from_']}\n📅 Date: {e['date']}\n📌 Subject: {e['subject']}\n🏷️ Tags: {', '.join(e['tags'])}\n"
+        f"📝 Body: {(e['body'] or '')[:BODY_CHARS]}"
+        for e in emails
+    ]
+) if emails else "No matching emails found."
 
 # invoke chain. combine multiple things to run llm
 # here the prompt is then formatted with the data and then pased to model below and response is generated
-chain = prompt | model 
+chain = prompt | model
 
 # invoke the ollama and pass it
 result = chain.invoke({"email_data": email_data, "user_question": user_question})
-print(result)
\ No newline at end of file
+print(result)
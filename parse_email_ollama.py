@@ -1,105 +1,78 @@
-from utils.store_emails import store_emails_data, extract_valid_json
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from pydantic import BaseModel, Field
-from imap import fetch_all_emails
 from dotenv import load_dotenv
-from typing import Optional
-import time
-import json
 
-# load the end
+# load the env, before the utils that read their settings from it
 load_dotenv()
-start_time = time.time()
-print(f"Started at {start_time}")
 
-# define a pydantic class to get structured output from the model
-class EmailResponse(BaseModel):
-    to: str = Field(..., description="Receiver's email id")
-    from_: str = Field(..., alias='from', description="Sender email id")
-    cc: Optional[str] = Field(..., description="Email id present in cc")
-    bcc: Optional[str] = Field(..., description="Email id present in bcc")
-    subject: str = Field(..., description="Subject of the email")
-    body: str = Field(..., description="Body of the email")
-    tags: list[str] = Field(..., description="Tags assigned to the email")
-    
-# select the req model
-model = OllamaLLM(model="gemma3")
+from utils.email_store import EmailStore
+from utils.sync_state import SyncState
+import ollama
+from utils.prompts import OLLAMA_TEMPLATE, EmailInsights
+from utils.sync_coordinator import SyncCoordinator
+from utils.normalize import EmailNormalizer
+from utils.llm_engine import ClassificationEngine
+from utils.llm_cache import LLMCache
+from utils.preclassifier import PreClassifier, PRECLASSIFIER_TRAINING_EMAILS
+from utils.llm_backends import OllamaBackend
+from utils.telemetry import metrics, setup_logging
+import logging
+import time
 
-# set up a parser to get JSON output
-parser = PydanticOutputParser(pydantic_object=EmailResponse)
+# LOG_LEVEL=DEBUG also logs the spans and payloads, LOG_FORMAT=json writes JSON lines
+setup_logging()
+logger = logging.getLogger("parse_email_ollama")
+start_time = time.time()
+logger.info(f"Started at {start_time}")
 
-# define a prompt template with data to be passed
-template = """You are a highly skilled data analyst specializing in extracting actionable insights from email communications. 
-              Your primary task is to meticulously transform raw email data into a structured JSON format, providing a concise and informative representation of each email.
-              
-              ### **Objective**: Convert the provided raw email data into a JSON object adhering to the specified schema.
+# select the req model, one client is shared by all requests (OLLAMA_HOST)
+client = ollama.Client()
+model_name = "gemma3"
 
-              ### **Output JSON format:**
-              ```json
-              {{
-                "to": "receiver's email id",
-                "from": "sender email id",
-                "cc": "return any email id present in cc else null",
-                "bcc": "return any email id present in bcc else null",
-                "subject": "return the subject of the email",
-                "body": "return the exact body of the email if it does not contain any html content. If the body contains any html content, then return it in markdown format",
-                "tags": "Analyze the email and assign relevant tags from the list below. Select the most appropriate tags based on the email's content. The tags should be returned as a JSON list of strings. Example: `["Project Update", "Urgent/High priority"]"
-              }}
-              ```           
-              ### **Important Guidelines & Constraints:**
-                - **Content Preservation: Absolutely do not modify or alter the original email content unless it contains HTML**. Maintain the original wording and formatting as closely as possible.
-                - **HTML Handling**: If the email contains HTML content, parse and convert it into a simple text format.** Ensure that the essence of the message is retained while removing any unnecessary HTML tags or attributes.
-                - **Tagging**: Use only the specified tags for categorizing the email. The tags should be returned as a JSON list of strings. Example: `["Project Update", "Urgent/High priority"]. The tags are: "Invoice, Order Confirmation, Payments, Meeting Invite/Calendar Invite, Meeting Update, Newsletter, Promotional / Marketing / Advertisement, Support Ticket Confirmation, Support Ticket Update, Banking, Travel, Health/Medical, Event/Registration, Approval Request, Approval Confirmation, Urgent/High priority, For review, Project Update, Internal Anouncement, Report, Expense Report, IT Notification, HR". Ensure that the tags accurately reflect the content of the email.
-                - **Email Address Formatting**: Ensure that email addresses are formatted correctly. Include the name followed by the email ID in the respective fields (to, from, cc, bcc).
-                - **JSON Output**: **Strictly return your final output as a valid JSON object. Ensure the JSON is well-formed and easily parsable.**
-                - **Error Handling**: If any errors occur during processing, provide a clear and concise error message indicating the nature of the issue.
-                
-              ### **Points to Remember (Reiteration for Clarity):**
-                - ### **No Modification**: Preserve original email content.
-                - ### **HTML Parsing**: Extract plain text from HTML emails.
-                - ### **Limited Tags**: Use only the provided tag list.
-                - ### **Accurate Identification**: Correctly populate recipient fields.
-                - ### **JSON Format**: Return only valid JSON.
-                - ### **Error Reporting**: Clearly indicate any errors encountered.
-              **Email Data** : {email_data}
-          """
-          
-# create prompt template to pass the data
-prompt = ChatPromptTemplate.from_template(template).partial(format_instructions=parser.get_format_instructions())
+# prompt template and response schema are shared with the monitoring daemon (utils/prompts.py)
+template = OLLAMA_TEMPLATE
 
 # fetch the emails
-emails = fetch_all_emails()
+# only new mail since the last run is fetched. every account/folder of accounts.json (or the env account)
+# is synced on its own thread and emails are streamed while the current ones are being classified
+sync_state = SyncState()
+store = EmailStore()
+coordinator = SyncCoordinator(sync_state=sync_state)
+emails = coordinator.iter_emails()
 
-print("length", len(emails))
-print("emails", emails, end="\n\n")
-print("prompt", prompt, end="\n\n")
+# html to text, quoted replies and signatures stripped, headers fully decoded, before anything is prompted
+normalizer = EmailNormalizer()
+emails = map(normalizer.normalize, emails)
 
-# process email 
-processed_emails = []
-for email_data in emails:
-    try:
-        # Make a chain to pass the prompt to the model along with the parser to get the required output
-        chain = prompt | model | parser
-        print("chain", chain)
+# resolve the thread from Message-ID/In-Reply-To/References, replies are classified on their new text plus the thread summary
+emails = map(store.annotate_thread, emails)
 
-        # Invoke the chain
-        result = chain.invoke({"email_data": email_data})
-
-        print("✅ Parsed result: ", result, end="\n\n")
+# process email 
+# the output is constrained to the schema and a generation that can no longer validate is aborted early.
+# the model is loaded before the first email and kept loaded between requests (OLLAMA_KEEP_ALIVE),
+# the requests are sent by worker threads (LLM_CONCURRENCY, LLM_REQUESTS_PER_MINUTE),
+# set LLM_BATCH_TOKENS to pack several emails into one request
+# obvious tags are assigned locally (PRECLASSIFIER_THRESHOLD, trained on the newest PRECLASSIFIER_TRAINING_EMAILS),
+# and emails already classified with the same prompt and model are answered from the local cache
+backend = OllamaBackend(client, model_name, template, EmailInsights)
+backend.warm_up()
+engine = ClassificationEngine(backend, cache=LLMCache(), preclassifier=PreClassifier(training_emails=store.query(source="model", limit=PRECLASSIFIER_TRAINING_EMAILS)))
+processed_emails = engine.classify_all(emails)
+        
+logger.info(f"length {len(processed_emails)}")
+logger.info(f"Email tokens: {normalizer.stats['raw_tokens']} raw, {normalizer.stats['clean_tokens']} after normalization")
+logger.info(f"Ended at {time.time()}")
+logger.info(f"Total time taken: {time.time() - start_time}")
+# the payloads are only formatted when debug logging is on
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug(f"processed emails {processed_emails}")
 
-        if isinstance(result, EmailResponse):
-            processed_emails.append(result.model_dump())
-        else:
-            print(f"❌ Invalid response format: {type(result)}")
+# Store the processed emails, reruns update the existing entries (python -m utils.email_store exports the text files)
+store.store(processed_emails)
 
-    except Exception as e:
-        print(f"❌ Error processing email in parse email: {e}")
-        
-print("Ended at ", time.time())
-print("Total time taken: ", time.time() - start_time)
-print("processed emails", processed_emails)
+# remember the last processed UID so the next run only fetches new mail, failed emails are fetched again
+for email_data in engine.failed:
+    sync_state.hold_back(email_data["meta"])
+sync_state.save()
+coordinator.close()
 
-# Store the processed emails
-store_emails_data(processed_emails)
\ No newline at end of file
+# per-stage timings, token usage and retries in the Prometheus text format (METRICS_FILE)
+metrics.write()
\ No newline at end of file
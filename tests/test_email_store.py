@@ -0,0 +1,62 @@
+import sqlite3
+from utils.email_store import EmailStore
+from utils.normalize import EmailNormalizer
+
+def stored(message_id, date, summary, **fields):
+    return {"message_id": message_id, "thread_id": "<root@x>", "date": date, "subject": "Budget", "body": "",
+            "summary": summary, "tags": ["Report"], **fields}
+
+def test_local_summary_keeps_the_thread_summary(tmp_path):
+    store = EmailStore(str(tmp_path / "emails.sqlite3"))
+    store.store([stored("<root@x>", "Mon, 1 Jan 2024 10:00:00 +0000", "Budget for Q3 needs approval by Friday.")])
+    store.store([stored("<reply@x>", "Mon, 1 Jan 2024 11:00:00 +0000", "Thanks, noted.", source="preclassifier")])
+    assert store.thread_summary("<root@x>") == "Budget for Q3 needs approval by Friday."
+
+    store.store([stored("<reply2@x>", "Mon, 1 Jan 2024 12:00:00 +0000", "Budget approved by Bob.")])
+    assert store.thread_summary("<root@x>") == "Budget approved by Bob."
+
+def test_reply_without_thread_summary_gets_the_quoted_history(tmp_path):
+    store = EmailStore(str(tmp_path / "emails.sqlite3"))
+    normalizer = EmailNormalizer()
+    reply = normalizer.normalize({
+        "subject": "Re: Budget",
+        "body": "Approved.\n\nOn Mon, 1 Jan 2024, Alice <alice@x.com> wrote:\n> Can you approve the Q3 budget?\n",
+        "meta": {"message_id": "<reply@x>", "in_reply_to": "<root@x>", "references": ["<root@x>"]},
+    })
+    assert reply["body"] == "Approved."
+
+    # the parent is classified in the same run, so there is no summary yet
+    annotated = store.annotate_thread(reply)
+    assert "Can you approve the Q3 budget?" in annotated["quoted_history"]
+    assert "thread_summary" not in annotated
+
+    store.store([stored("<root@x>", "Mon, 1 Jan 2024 10:00:00 +0000", "Alice asks to approve the Q3 budget.")])
+    annotated = store.annotate_thread(reply)
+    assert annotated["thread_summary"] == "Alice asks to approve the Q3 budget."
+    assert "quoted_history" not in annotated
+
+def test_only_the_model_results_are_training_emails(tmp_path):
+    path = str(tmp_path / "emails.sqlite3")
+    # a store created before the source column
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE emails (message_id TEXT PRIMARY KEY, thread_id TEXT, date TEXT, sender TEXT, recipients TEXT, "
+                 "cc TEXT, bcc TEXT, subject TEXT, body TEXT, summary TEXT, tags TEXT NOT NULL, stored_at REAL NOT NULL)")
+    conn.execute("INSERT INTO emails (message_id, tags, stored_at) VALUES ('<old@x>', '[]', 0)")
+    conn.commit()
+    conn.close()
+
+    store = EmailStore(path)
+    store.store([stored("<root@x>", "Mon, 1 Jan 2024 10:00:00 +0000", "Budget for Q3.")])
+    store.store([stored("<reply@x>", "Mon, 1 Jan 2024 11:00:00 +0000", "Thanks.", source="preclassifier")])
+    assert [email["message_id"] for email in store.query(source="model")] == ["<root@x>"]
+    assert {email["message_id"]: email["source"] for email in store.query()} == {
+        "<root@x>": "model", "<reply@x>": "preclassifier", "<old@x>": None,
+    }
+
+def test_email_without_thread_is_its_own_thread(tmp_path):
+    store = EmailStore(str(tmp_path / "emails.sqlite3"))
+    store.store([
+        {"message_id": "<a@x>", "subject": "Invoice", "body": "", "tags": ["Invoice"]},
+        {"message_id": "<b@y>", "subject": "Re: Invoice", "body": "", "tags": ["Invoice"]},
+    ])
+    assert {email["message_id"]: email["thread_id"] for email in store.query()} == {"<a@x>": "<a@x>", "<b@y>": "<b@y>"}
@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+import time
+import pytest
+from monitor_emails import make_process
+from utils.email_store import EmailStore
+from utils.fake_imap_server import FakeIMAPServer, sample_message
+from utils.idle_monitor import MailboxMonitor
+from utils.llm_engine import ClassificationEngine
+from utils.normalize import EmailNormalizer
+from utils.sync_coordinator import SyncCoordinator
+from utils.sync_state import SyncState
+from utils.telemetry import metrics
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def reconnects():
+    return metrics.counters.get(("email_imap_reconnects_total", ()), 0)
+
+@pytest.mark.parametrize("idle", [True, False], ids=["idle", "noop"])
+def test_new_mail_is_processed_and_watchers_reconnect(tmp_path, monkeypatch, idle):
+    monkeypatch.setattr("utils.idle_monitor.POLL_SECONDS", 0.2)
+    server = FakeIMAPServer(idle=idle)
+    server.append(sample_message(0))
+    server.start()
+    coordinator = SyncCoordinator([server.account()], sync_state=SyncState(str(tmp_path / "sync_state.json")),
+                                  parse_processes=0)
+    subjects = []
+
+    def process(folders):
+        subjects.extend(email_data["subject"] for email_data in coordinator.iter_emails(folders))
+
+    monitor = MailboxMonitor(coordinator.accounts, process, debounce=0.05)
+    thread = threading.Thread(target=monitor.run)
+    thread.start()
+    try:
+        # mail already there is synced when the watcher connects
+        assert wait_for(lambda: subjects == ["Test message 0"])
+
+        server.append(sample_message(1))
+        assert wait_for(lambda: subjects[-1:] == ["Test message 1"])
+
+        # a dropped connection is reopened and mail that arrived meanwhile is synced; a partial line left
+        # from the old connection must not break the IDLE of the new one
+        before = reconnects()
+        server.disconnect_all()
+        assert wait_for(lambda: reconnects() == before + 1)
+        monitor.watchers[0].buffer = b"* 3 EXI"
+        server.append(sample_message(2))
+        assert wait_for(lambda: subjects[-1:] == ["Test message 2"])
+        server.append(sample_message(3))
+        assert wait_for(lambda: subjects[-1:] == ["Test message 3"])
+        assert reconnects() == before + 1
+    finally:
+        monitor.stop()
+        thread.join(timeout=10)
+        coordinator.close()
+        server.stop()
+    assert not thread.is_alive()
+    assert subjects == [f"Test message {number}" for number in range(4)]
+
+class EchoBackend:
+    prompt = "prompt"
+    model_name = "test"
+
+    def classify(self, email_data):
+        return {"tags": [], "summary": email_data["subject"]}
+
+def test_failed_batch_puts_the_high_water_mark_back(tmp_path, monkeypatch):
+    server = FakeIMAPServer()
+    server.start()
+    sync_state = SyncState(str(tmp_path / "sync_state.json"))
+    coordinator = SyncCoordinator([server.account()], sync_state=sync_state, parse_processes=0)
+    store = EmailStore(str(tmp_path / "emails.sqlite3"))
+    process = make_process(coordinator, EmailNormalizer(), store, ClassificationEngine(EchoBackend()), sync_state)
+    folders = [(coordinator.accounts[0], "INBOX")]
+    try:
+        server.append(sample_message(1))
+        def locked(emails):
+            raise sqlite3.OperationalError("database is locked")
+
+        store_emails = store.store
+        monkeypatch.setattr(store, "store", locked)
+        with pytest.raises(sqlite3.OperationalError):
+            process(folders)
+
+        monkeypatch.setattr(store, "store", store_emails)
+        server.append(sample_message(2))
+        process(folders)
+        assert sorted(email_data["subject"] for email_data in store.query()) == ["Test message 1", "Test message 2"]
+        assert next(iter(SyncState(sync_state.path).state.values()))["last_uid"] == 2
+    finally:
+        coordinator.close()
+        server.stop()
@@ -0,0 +1,48 @@
+import pytest
+from pydantic import TypeAdapter
+from utils.llm_backends import OllamaBackend, partial_error
+from utils.prompts import OLLAMA_TEMPLATE, EmailInsights
+from utils.telemetry import metrics
+
+class StreamingClient:
+    """Fake ollama client streaming the given chunks, it records how many were read and when the stream was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+        self.closed_after = None
+
+    def generate(self, model, prompt, format=None, stream=False, keep_alive=None, options=None):
+        def chunks():
+            try:
+                for text in self.chunks:
+                    self.read += 1
+                    yield {"response": text, "done": False}
+                yield {"response": "", "done": True}
+            finally:
+                self.closed_after = self.read
+        return chunks()
+
+def aborted():
+    return metrics.counters.get(("email_llm_aborted_total", (("backend", "ollama"),)), 0)
+
+def test_invalid_stream_is_closed_at_the_first_bad_chunk():
+    client = StreamingClient(['{"tags": ', '"Invoice", ', '"summary": "', "never read", '"}'])
+    backend = OllamaBackend(client, "gemma3", OLLAMA_TEMPLATE, EmailInsights)
+    before = aborted()
+    with pytest.raises(ValueError, match="Generation aborted"):
+        backend.classify({"subject": "Invoice"})
+    assert client.closed_after == 2
+    assert aborted() == before + 1
+
+def test_valid_stream_in_any_field_order_is_not_aborted():
+    client = StreamingClient(['{"summary": "Pay', ' by Friday.", ', '"tags": ["Inv', 'oice"]', "}"])
+    backend = OllamaBackend(client, "gemma3", OLLAMA_TEMPLATE, EmailInsights)
+    before = aborted()
+    assert backend.classify({"subject": "Invoice"}) == {"tags": ["Invoice"], "summary": "Pay by Friday."}
+    assert client.closed_after == len(client.chunks)
+    assert aborted() == before
+
+@pytest.mark.parametrize("text", ['{"tags": ["a"', '{"summary": "x", "ta', '   '])
+def test_unfinished_fields_are_not_errors(text):
+    assert partial_error(TypeAdapter(EmailInsights), text) is None
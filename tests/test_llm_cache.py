@@ -0,0 +1,27 @@
+import itertools
+import json
+from utils import llm_cache
+from utils.llm_cache import LLMCache
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: next(clock))
+    response = {"tags": ["Report"], "summary": "x" * 70}
+    entry_size = len(json.dumps(response))
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), max_bytes=3 * entry_size)
+
+    for number in range(3):
+        cache.put("v1", {"body": f"email {number}"}, response)
+    assert cache.size == 3 * entry_size
+    # email 0 is used again, so email 1 is now the least recently used
+    assert cache.get("v1", {"body": "email 0"}) == response
+
+    cache.put("v1", {"body": "email 3"}, response)
+    assert cache.get("v1", {"body": "email 1"}) is None
+    assert cache.get("v1", {"body": "email 0"}) == response
+    assert cache.get("v1", {"body": "email  3"}) == response
+    assert cache.stats() == {"hits": 3, "misses": 1, "bytes": 3 * entry_size}
+
+    # the tracked size matches the stored entries when the cache is opened again
+    cache.conn.close()
+    assert LLMCache(str(tmp_path / "cache.sqlite3"), max_bytes=3 * entry_size).size == 3 * entry_size
@@ -0,0 +1,41 @@
+from utils.llm_engine import ClassificationEngine
+
+class AuthError(Exception):
+    code = 401
+
+class RaisingBackend:
+    prompt = "prompt"
+    model_name = "test"
+
+    def __init__(self, error):
+        self.error = error
+        self.requests = 0
+
+    def classify(self, email_data):
+        self.requests += 1
+        raise self.error
+
+    def classify_batch(self, batch):
+        self.requests += 1
+        raise self.error
+
+def classify(error, count=8):
+    backend = RaisingBackend(error)
+    engine = ClassificationEngine(backend, batch_tokens=100000, max_retries=0)
+    processed = engine.classify_all([{"subject": f"email {number}"} for number in range(count)])
+    return backend.requests, processed, engine.failed
+
+def test_malformed_batch_is_split_down_to_single_emails():
+    requests, processed, failed = classify(ValueError("invalid JSON"))
+    assert (requests, processed, len(failed)) == (15, [], 8)
+
+def test_auth_error_fails_the_batch_without_splitting():
+    requests, processed, failed = classify(AuthError("API key not valid"))
+    assert (requests, processed, len(failed)) == (1, [], 8)
+
+def test_settings_are_read_when_the_engine_is_created(monkeypatch):
+    monkeypatch.setenv("LLM_REQUESTS_PER_MINUTE", "10")
+    monkeypatch.setenv("LLM_CONCURRENCY", "2")
+    engine = ClassificationEngine(RaisingBackend(ValueError()))
+    assert engine.concurrency == 2
+    assert engine.rate_limiter.rate == 10 / 60
@@ -0,0 +1,91 @@
+import email
+import hashlib
+from email.message import EmailMessage
+import pytest
+from benchmarks.mailbox import generate_mailbox
+from imap import parse_email_chunks
+from utils.mime_stream import MimeStreamParser
+
+def edge_cases():
+    qp = EmailMessage()
+    qp["Subject"] = "quoted-printable"
+    qp.set_content("Zürich café " * 40 + "\nline two with = sign", charset="utf-8", cte="quoted-printable")
+
+    latin = EmailMessage()
+    latin["Subject"] = "latin-1 declared as utf-8"
+    latin.set_content("héllo wörld".encode("latin-1"), maintype="text", subtype="plain", cte="8bit")
+    latin.set_param("charset", "utf-8")
+
+    nested = EmailMessage()
+    nested["Subject"] = "nested"
+    nested.set_content("outer text")
+    nested.add_attachment(b"x" * 1000, maintype="application", subtype="zip", filename="a.zip")
+    inner = EmailMessage()
+    inner["Subject"] = "inner"
+    inner.set_content("inner body")
+    nested.add_attachment(inner)
+
+    html = EmailMessage()
+    html["Subject"] = "html only"
+    html.set_content("<p>only <b>html</b></p>", subtype="html")
+    html.add_attachment(bytes(range(256)) * 300, maintype="application", subtype="octet-stream", filename="b.bin")
+    return [message.as_bytes() for message in (qp, latin, nested, html)]
+
+MESSAGES = generate_mailbox(150, seed=3) + edge_cases()
+
+def leaf_parts(part):
+    """The leaf parts of a message; an attached message/rfc822 is a leaf, it is not descended into."""
+    if part.get_content_maintype() != "multipart":
+        return [part]
+    return [leaf for sub_part in part.get_payload() for leaf in leaf_parts(sub_part)]
+
+def reference(raw):
+    """Body and leaf parts of a message as parsed by the stdlib email package."""
+    message = email.message_from_bytes(raw)
+    leaves = leaf_parts(message)
+
+    def first(content_type):
+        return next((
+            part for part in leaves
+            if part.get_content_type() == content_type and part.get_content_disposition() != "attachment"
+        ), None)
+
+    text_part = first("text/plain") or first("text/html")
+    body = text_part.get_payload(decode=True).decode(text_part.get_content_charset() or "utf-8", "replace") if text_part else ""
+    return body, leaves
+
+@pytest.mark.parametrize("chunk_size", [7, 1000, None])
+def test_parity_with_the_stdlib_parser(chunk_size):
+    for raw in MESSAGES:
+        size = chunk_size or len(raw)
+        parsed = parse_email_chunks([raw[start:start + size] for start in range(0, len(raw), size)])
+        body, leaves = reference(raw)
+
+        if "latin-1" not in parsed["subject"]:
+            assert parsed["body"].rstrip("\r\n") == body.rstrip("\r\n"), parsed["subject"]
+        parts = parsed["meta"]["parts"]
+        assert [part["content_type"] for part in parts] == [leaf.get_content_type() for leaf in leaves], parsed["subject"]
+        for part, leaf in zip(parts, leaves):
+            if leaf.get_content_maintype() not in ("text", "message"):
+                payload = leaf.get_payload(decode=True)
+                assert part["size"] == len(payload)
+                assert part["sha256"] == hashlib.sha256(payload).hexdigest()
+
+def test_charset_fallback():
+    parsed = parse_email_chunks([edge_cases()[1]])
+    assert parsed["body"].strip() == "héllo wörld"
+
+def test_size_caps():
+    raw = edge_cases()[3]
+    parser = MimeStreamParser(max_part_bytes=1000)
+    parser.feed(raw)
+    parser.close()
+    attachment = parser.parts[-1].metadata()
+    assert attachment["truncated"] and attachment["sha256"] is None and attachment["size"] == 256 * 300
+    parser.cleanup()
+
+    parser = MimeStreamParser(max_message_bytes=len(raw) // 2)
+    parser.feed(raw)
+    parser.close()
+    assert parser.truncated and parser.text_part() is not None
+    parser.cleanup()
@@ -0,0 +1,31 @@
+from utils.normalize import EmailNormalizer
+
+def test_forwarded_message_stays_in_the_body():
+    normalizer = EmailNormalizer()
+    email_data = normalizer.normalize({
+        "subject": "Fwd: Contract",
+        "body": (
+            "FYI, see below.\n\n"
+            "---------- Forwarded message ---------\n"
+            "From: Bob <bob@x.com>\n"
+            "Date: Mon, 1 Jan 2024 at 10:00\n"
+            "Subject: Contract\n\n"
+            "The signed contract is attached.\n"
+            "> earlier question\n"
+        ),
+        "meta": {},
+    })
+    assert email_data["body"].startswith("FYI, see below.")
+    assert "The signed contract is attached." in email_data["body"]
+    assert "From: Bob <bob@x.com>" in email_data["body"]
+    assert "quoted" not in email_data["meta"]
+
+def test_reply_chain_is_moved_to_the_meta():
+    normalizer = EmailNormalizer()
+    email_data = normalizer.normalize({
+        "subject": "Re: Contract",
+        "body": "Thanks!\n\nOn Mon, 1 Jan 2024, Bob <bob@x.com> wrote:\n> The signed contract is attached.\n",
+        "meta": {},
+    })
+    assert email_data["body"] == "Thanks!"
+    assert "The signed contract is attached." in email_data["meta"]["quoted"]
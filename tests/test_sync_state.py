@@ -0,0 +1,64 @@
+from utils.fake_imap_server import FakeIMAPServer, sample_message
+from utils.llm_engine import ClassificationEngine
+from utils.sync_coordinator import SyncCoordinator
+from utils.sync_state import SyncState
+
+class FailingBackend:
+    """Fails the emails whose subject contains one of the failing strings."""
+    prompt = "prompt"
+    model_name = "test"
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    def classify(self, email_data):
+        if any(text in email_data["subject"] for text in self.failing):
+            raise ValueError("malformed response")
+        return {"tags": [], "summary": email_data["subject"]}
+
+def sync_and_classify(server, path, backend, max_attempts=3):
+    sync_state = SyncState(path, max_attempts=max_attempts)
+    coordinator = SyncCoordinator([server.account()], sync_state=sync_state, parse_processes=0)
+    engine = ClassificationEngine(backend, max_retries=0)
+    try:
+        processed = engine.classify_all(coordinator.iter_emails())
+    finally:
+        coordinator.close()
+    for email_data in engine.failed:
+        sync_state.hold_back(email_data["meta"])
+    sync_state.save()
+    return sorted(email_data["subject"] for email_data in processed)
+
+def test_failed_email_is_fetched_again(tmp_path):
+    server = FakeIMAPServer()
+    server.start()
+    try:
+        for number in (1, 2, 3):
+            server.append(sample_message(number))
+        path = tmp_path / "sync_state.json"
+
+        assert sync_and_classify(server, path, FailingBackend(["message 2"])) == ["Test message 1", "Test message 3"]
+        # the mark stays below the failed email, the ones above it are fetched again too
+        assert sync_and_classify(server, path, FailingBackend([])) == ["Test message 2", "Test message 3"]
+        assert sync_and_classify(server, path, FailingBackend([])) == []
+    finally:
+        server.stop()
+
+def test_email_failing_every_time_is_given_up_on(tmp_path):
+    server = FakeIMAPServer()
+    server.start()
+    try:
+        for number in (1, 2, 3):
+            server.append(sample_message(number))
+        path = tmp_path / "sync_state.json"
+        backend = FailingBackend(["message 2"])
+
+        assert sync_and_classify(server, path, backend, max_attempts=2) == ["Test message 1", "Test message 3"]
+        # the second failure is the last attempt, the mark moves past the email
+        assert sync_and_classify(server, path, backend, max_attempts=2) == ["Test message 3"]
+        assert sync_and_classify(server, path, backend, max_attempts=2) == []
+
+        entry = next(iter(SyncState(path).state.values()))
+        assert (entry["last_uid"], entry["failed"], entry["attempts"]) == (3, [2], {})
+    finally:
+        server.stop()
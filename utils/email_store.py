@@ -0,0 +1,355 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from datetime import timezone
+from utils.llm_cache import content_hash
+from utils.telemetry import span
+from utils.store_emails import store_emails_data, load_emails_data
+
+logger = logging.getLogger(__name__)
+
+EMAIL_STORE_PATH = os.getenv("EMAIL_STORE_PATH", "emails.sqlite3")
+
+# rows written per executemany call inside a transaction
+WRITE_BATCH_SIZE = 500
+
+# characters of the quoted history prompted for a reply whose thread has no summary yet
+QUOTED_HISTORY_CHARS = int(os.getenv("QUOTED_HISTORY_CHARS", 4000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    message_id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    date TEXT,
+    sender TEXT,
+    recipients TEXT,
+    cc TEXT,
+    bcc TEXT,
+    subject TEXT,
+    body TEXT,
+    summary TEXT,
+    tags TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS email_tags (
+    message_id TEXT NOT NULL REFERENCES emails (message_id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (message_id, tag)
+);
+CREATE INDEX IF NOT EXISTS emails_sender ON emails (sender);
+CREATE INDEX IF NOT EXISTS emails_date ON emails (date);
+CREATE INDEX IF NOT EXISTS emails_thread ON emails (thread_id, date);
+CREATE INDEX IF NOT EXISTS email_tags_tag ON email_tags (tag, message_id);
+CREATE TABLE IF NOT EXISTS message_threads (
+    message_id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS message_threads_thread ON message_threads (thread_id);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    summary TEXT,
+    last_date TEXT
+);
+"""
+
+# BM25 full-text index (SQLite FTS5), its rowids are the rowids of the emails table
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE email_search USING fts5 (subject, body, sender, tags, tokenize = 'porter unicode61');
+INSERT INTO email_search (rowid, subject, body, sender, tags) SELECT rowid, subject, body, sender, tags FROM emails;
+"""
+
+# relative weight of a match in subject, body, sender and tags
+SEARCH_WEIGHTS = (3.0, 1.0, 2.0, 2.0)
+
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "about", "all", "did", "do", "does", "for", "from", "have", "how", "i", "in",
+    "is", "it", "me", "my", "of", "on", "or", "show", "tell", "that", "the", "there", "to", "was", "were", "what",
+    "when", "which", "who", "with", "list", "emails", "email", "mail", "mails",
+}
+
+def search_query(text):
+    """Turns a free-text question into an FTS5 query matching any of its significant words."""
+    words = [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+def iso_date(value):
+    """Converts an RFC 2822 Date header to a sortable UTC ISO timestamp, or None."""
+    if not value:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).isoformat()
+
+def message_key(email_json):
+    """The Message-ID of a processed email, or a content hash for emails without one."""
+    message_id = email_json.get("message_id")
+    if message_id:
+        return message_id
+    return "<sha256-" + content_hash(
+        email_json.get("from_") or email_json.get("from"), email_json.get("date"),
+        email_json.get("subject"), email_json.get("body")
+    ) + ">"
+
+class EmailStore:
+    """SQLite (WAL) store of processed emails, indexed by sender, date, tag and thread.
+
+    Writes are batched in one transaction and upserted by Message-ID, so re-processing an email
+    replaces its entry instead of duplicating it.
+    """
+
+    def __init__(self, path=EMAIL_STORE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        # stores created before the source column: their rows keep a NULL (unknown) source
+        if "source" not in {row[1] for row in self.conn.execute("PRAGMA table_info(emails)")}:
+            with self.conn:
+                self.conn.execute("ALTER TABLE emails ADD COLUMN source TEXT")
+        # the search index is built from the existing emails the first time, then updated on every store()
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'email_search'").fetchone():
+            with self.conn:
+                self.conn.executescript(SEARCH_SCHEMA)
+
+    def resolve_thread(self, message_id, in_reply_to=None, references=()):
+        """Returns the thread of a message from its Message-ID, In-Reply-To and References headers.
+
+        Every id seen is mapped to the thread, so replies arriving before their parent still join it.
+        When a message links two known threads, they are merged into the first one.
+        """
+        ids = [ref for ref in dict.fromkeys([*references, in_reply_to, message_id]) if ref]
+        if not ids:
+            return None
+        known = self.conn.execute(
+            f"SELECT message_id, thread_id FROM message_threads WHERE message_id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        thread_ids = list(dict.fromkeys(row[1] for row in known))
+        # the oldest reference is the root of the conversation
+        thread_id = thread_ids[0] if thread_ids else ids[0]
+
+        with self.conn:
+            for other in thread_ids[1:]:
+                self.conn.execute("UPDATE message_threads SET thread_id = ? WHERE thread_id = ?", (thread_id, other))
+                self.conn.execute("UPDATE emails SET thread_id = ? WHERE thread_id = ?", (thread_id, other))
+                self.conn.execute("DELETE FROM threads WHERE thread_id = ?", (other,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO message_threads (message_id, thread_id) VALUES (?, ?)",
+                [(ref, thread_id) for ref in ids],
+            )
+        return thread_id
+
+    def thread_summary(self, thread_id):
+        """The rolling summary of a thread, as returned by the model for its latest message."""
+        row = self.conn.execute("SELECT summary FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        return row[0] if row else None
+
+    def annotate_thread(self, email_data):
+        """Pipeline stage: resolves the thread of a fetched email and adds the thread summary to its prompt data.
+
+        The body is already stripped of the quoted history, so a reply is classified on its new text
+        plus a summary of constant size instead of the whole conversation. Summaries are only stored once
+        the emails are classified, so when the thread has none yet (its parent is in the same sync), the
+        start of the quoted history is prompted instead.
+        """
+        meta = email_data.get("meta") or {}
+        thread_id = self.resolve_thread(meta.get("message_id"), meta.get("in_reply_to"), meta.get("references") or ())
+        email_data = {**email_data, "meta": {**meta, "thread_id": thread_id}}
+        summary = self.thread_summary(thread_id) if thread_id else None
+        if summary:
+            email_data["thread_summary"] = summary
+        elif meta.get("quoted"):
+            email_data["quoted_history"] = meta["quoted"][:QUOTED_HISTORY_CHARS]
+        return email_data
+
+    def _row(self, email_json):
+        subject = email_json.get("subject") or ""
+        key = message_key(email_json)
+        return (
+            key,
+            # an email without thread headers is a conversation of its own, subjects like "Invoice" are too common
+            email_json.get("thread_id") or key,
+            iso_date(email_json.get("date")),
+            email_json.get("from_") or email_json.get("from"),
+            email_json.get("to"),
+            email_json.get("cc"),
+            email_json.get("bcc"),
+            subject,
+            email_json.get("body"),
+            email_json.get("summary"),
+            json.dumps(list(email_json.get("tags") or [])),
+            time.time(),
+            # "preclassifier" for the locally tagged emails, "model" for the model results and the legacy files
+            email_json.get("source") or "model",
+        )
+
+    def store(self, email_data_list):
+        """Upserts processed emails (dicts like the engine results) in one transaction, returns the stored count."""
+        if isinstance(email_data_list, dict):
+            email_data_list = [email_data_list]
+        email_data_list = [email_json for email_json in email_data_list if isinstance(email_json, dict)]
+        rows = [self._row(email_json) for email_json in email_data_list]
+        # only a model summary covers the conversation, the local first-sentence one never replaces it
+        summarized = {row[0] for row in rows if row[12] != "preclassifier"}
+
+        with span("store", emails=len(rows), target="sqlite"):
+            with self.conn:
+                for start in range(0, len(rows), WRITE_BATCH_SIZE):
+                    batch = rows[start:start + WRITE_BATCH_SIZE]
+                    self.conn.executemany(
+                        "INSERT INTO emails (message_id, thread_id, date, sender, recipients, cc, bcc, subject, body, "
+                        "summary, tags, stored_at, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (message_id) DO UPDATE SET thread_id = excluded.thread_id, date = excluded.date, "
+                        "sender = excluded.sender, recipients = excluded.recipients, cc = excluded.cc, bcc = excluded.bcc, "
+                        "subject = excluded.subject, body = excluded.body, summary = excluded.summary, "
+                        "tags = excluded.tags, stored_at = excluded.stored_at, source = excluded.source",
+                        batch,
+                    )
+                    self._index([row[0] for row in batch])
+                    self.conn.executemany("DELETE FROM email_tags WHERE message_id = ?", [(row[0],) for row in batch])
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO email_tags (message_id, tag) VALUES (?, ?)",
+                        [(row[0], tag) for row in batch for tag in json.loads(row[10])],
+                    )
+                    # the model summary of the newest message becomes the thread summary
+                    self.conn.executemany(
+                        "INSERT INTO threads (thread_id, summary, last_date) VALUES (?, ?, ?) "
+                        "ON CONFLICT (thread_id) DO UPDATE SET summary = excluded.summary, last_date = excluded.last_date "
+                        "WHERE excluded.last_date >= COALESCE(threads.last_date, '')",
+                        [(row[1], row[9], row[2] or "") for row in batch if row[9] and row[0] in summarized],
+                    )
+        logger.info(f"✅ Stored {len(rows)} emails in the email store")
+        return len(rows)
+
+    def _index(self, message_ids):
+        """Re-indexes the given emails in the full-text index (called inside the store() transaction)."""
+        rows = self.conn.execute(
+            f"SELECT rowid, subject, body, sender, tags FROM emails WHERE message_id IN ({','.join('?' * len(message_ids))})",
+            message_ids,
+        ).fetchall()
+        self.conn.executemany("DELETE FROM email_search WHERE rowid = ?", [(row[0],) for row in rows])
+        self.conn.executemany(
+            "INSERT INTO email_search (rowid, subject, body, sender, tags) VALUES (?, ?, ?, ?, ?)",
+            [tuple(row) for row in rows],
+        )
+
+    @staticmethod
+    def _email(row):
+        return {
+            "message_id": row["message_id"],
+            "thread_id": row["thread_id"],
+            "date": row["date"],
+            "to": row["recipients"],
+            "from_": row["sender"],
+            "cc": row["cc"],
+            "bcc": row["bcc"],
+            "subject": row["subject"],
+            "body": row["body"],
+            "summary": row["summary"],
+            "tags": json.loads(row["tags"]),
+            "source": row["source"],
+        }
+
+    def query(self, tag=None, since=None, until=None, sender=None, thread_id=None, source=None, limit=None):
+        """Returns stored emails, newest first, filtered by tag, date range (ISO strings), sender, thread or source."""
+        sql = "SELECT e.* FROM emails e"
+        where, params = [], []
+        if tag is not None:
+            sql += " JOIN email_tags t ON t.message_id = e.message_id"
+            where.append("t.tag = ?")
+            params.append(tag)
+        if since is not None:
+            where.append("e.date >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("e.date < ?")
+            params.append(until)
+        if sender is not None:
+            where.append("e.sender = ?")
+            params.append(sender)
+        if thread_id is not None:
+            where.append("e.thread_id = ?")
+            params.append(thread_id)
+        if source is not None:
+            where.append("e.source = ?")
+            params.append(source)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY e.date DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._email(row) for row in self.conn.execute(sql, params)]
+
+    def search(self, text, k=10, tag=None, since=None, until=None):
+        """Returns the k stored emails most relevant to a question (BM25), optionally filtered by tag and date range."""
+        query = search_query(text)
+        if not query:
+            return self.query(tag=tag, since=since, until=until, limit=k)
+
+        sql = "SELECT e.* FROM email_search s JOIN emails e ON e.rowid = s.rowid WHERE email_search MATCH ?"
+        params = [query]
+        if tag is not None:
+            sql += " AND e.message_id IN (SELECT message_id FROM email_tags WHERE tag = ?)"
+            params.append(tag)
+        if since is not None:
+            sql += " AND e.date >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND e.date < ?"
+            params.append(until)
+        sql += f" ORDER BY bm25(email_search, {', '.join(map(str, SEARCH_WEIGHTS))}) LIMIT ?"
+        params.append(k)
+        return [self._email(row) for row in self.conn.execute(sql, params)]
+
+    def tag_counts(self, since=None, until=None):
+        """Number of stored emails per tag, optionally within a date range."""
+        sql = "SELECT t.tag, COUNT(*) FROM email_tags t JOIN emails e ON e.message_id = t.message_id"
+        where, params = [], []
+        if since is not None:
+            where.append("e.date >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("e.date < ?")
+            params.append(until)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY t.tag ORDER BY COUNT(*) DESC"
+        return dict(self.conn.execute(sql, params).fetchall())
+
+    def export_text_files(self, output_folder="parsed_emails_export"):
+        """Writes the stored emails as the per-subject text files of store_emails_data, oldest first.
+
+        The folder is regenerated on every export, so keep it separate from the legacy parsed_emails folder.
+        """
+        if os.path.isdir(output_folder):
+            for file_name in os.listdir(output_folder):
+                if file_name.endswith(".txt"):
+                    os.remove(os.path.join(output_folder, file_name))
+        emails = self.query()
+        emails.reverse()
+        store_emails_data(emails, output_folder)
+        return len(emails)
+
+    def import_text_files(self, output_folder="parsed_emails"):
+        """Loads the emails of the legacy per-subject text files into the store."""
+        return self.store(load_emails_data(output_folder))
+
+# export / import the per-subject text files: python -m utils.email_store [import]
+if __name__ == "__main__":
+    store = EmailStore()
+    if len(sys.argv) > 1 and sys.argv[1] == "import":
+        store.import_text_files()
+    else:
+        print(f"Exported {store.export_text_files()} emails to parsed_emails_export")
@@ -0,0 +1,448 @@
+import argparse
+import email
+import re
+import socket
+import socketserver
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+# a quoted string, a parenthesis or an atom of a client command
+ARG_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|([()])|([^\s()"]+)')
+
+# a data item of a FETCH command, body sections keep their brackets and partial range
+FETCH_ITEM_RE = re.compile(r"(BODY(?:\.PEEK)?)\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|([A-Z0-9.]+)", re.I)
+
+def quote(value):
+    """Formats a value as an IMAP quoted string, or NIL."""
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def split_message(raw):
+    """Splits a raw message into its header block (with the blank line) and its body."""
+    for separator in (b"\r\n\r\n", b"\n\n"):
+        index = raw.find(separator)
+        if index != -1:
+            return raw[:index + len(separator)], raw[index + len(separator):]
+    return raw, b""
+
+def header_fields(header, names, exclude=False):
+    """Returns the header lines (with their continuation lines) whose name is in names."""
+    names = {name.upper() for name in names}
+    lines = []
+    keep = False
+    for line in header.splitlines(keepends=True):
+        if line.strip() == b"":
+            continue
+        if line[:1] not in (b" ", b"\t"):
+            name = line.split(b":", 1)[0].decode("ascii", "replace").strip().upper()
+            keep = (name in names) != exclude
+        if keep:
+            lines.append(line)
+    return b"".join(lines) + b"\r\n"
+
+def part_payload(part):
+    """The transfer-encoded body of a MIME part, as it appears in the message."""
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return b""
+    return payload.encode("ascii", "surrogateescape")
+
+def bodystructure(part):
+    """Builds the BODYSTRUCTURE of a parsed message (RFC 3501 7.4.2) with its extension data."""
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        boundary = part.get_boundary()
+        params = f'("BOUNDARY" {quote(boundary)})' if boundary else "NIL"
+        return f"({children} {quote(part.get_content_subtype().upper())} {params} NIL NIL NIL)"
+
+    params = [(key, value) for key, value in (part.get_params() or [])[1:]]
+    params = "(" + " ".join(f"{quote(key.upper())} {quote(value)}" for key, value in params) + ")" if params else "NIL"
+    payload = part_payload(part)
+    fields = [
+        quote(part.get_content_maintype().upper()),
+        quote(part.get_content_subtype().upper()),
+        params,
+        quote(part.get("Content-ID")),
+        "NIL",
+        quote((part.get("Content-Transfer-Encoding") or "7BIT").upper()),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disposition_params = f'("FILENAME" {quote(filename)})' if filename else "NIL"
+        disposition = f"({quote(disposition.upper())} {disposition_params})"
+    fields += ["NIL", disposition or "NIL", "NIL", "NIL"]
+    return "(" + " ".join(fields) + ")"
+
+def sample_message(number, sender="alerts@example.com", to="user@example.com", subject=None, body=None,
+                   attachment=None):
+    """Builds a small RFC822 message for the demo mailbox; attachment is an optional (filename, bytes) pair."""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject or f"Test message {number}"
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid(domain="example.com")
+    msg.set_content(body or f"This is test message number {number}.\nPlease review it.\n")
+    if attachment:
+        filename, data = attachment
+        msg.add_attachment(data, maintype="application", subtype="octet-stream", filename=filename)
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+class Mailbox:
+    """One folder of the stand-in server: its UIDVALIDITY and messages in UID order."""
+
+    def __init__(self, uidvalidity):
+        self.uidvalidity = uidvalidity
+        self.next_uid = 1
+        self.messages = []
+
+class Session(socketserver.StreamRequestHandler):
+    """One client connection, speaking the subset of IMAP4rev1 used by the sync code and the IDLE daemon."""
+
+    def setup(self):
+        super().setup()
+        self.lock = threading.Lock()
+        self.user = None
+        self.mailbox = None
+        self.mailbox_name = None
+        self.exists = 0
+        self.idling = False
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.lock:
+            self.wfile.write(data if data.endswith(b"\r\n") else data + b"\r\n")
+            self.wfile.flush()
+
+    def handle(self):
+        server = self.server.imap
+        server.sessions_add(self)
+        try:
+            self.send("* OK IMAP4rev1 stand-in server ready")
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                line = line.decode("utf-8", "replace").rstrip("\r\n")
+                tag, _, rest = line.partition(" ")
+                command, _, args = rest.partition(" ")
+                server.count_command()
+                if not self.dispatch(tag, command.upper(), args):
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            server.sessions_remove(self)
+
+    def dispatch(self, tag, command, args):
+        """Runs a command, returns False once the connection is to be closed."""
+        server = self.server.imap
+        if command == "CAPABILITY":
+            self.send(f"* CAPABILITY {' '.join(server.capabilities())}")
+        elif command == "LOGIN":
+            user, password = [value for value, _ in self.arguments(args)][:2]
+            if server.users.get(user) != password:
+                self.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials")
+                return True
+            self.user = user
+        elif command == "NOOP":
+            self.report_exists()
+        elif command in ("SELECT", "EXAMINE"):
+            name = self.arguments(args)[0][0]
+            mailbox = server.mailboxes.get(name)
+            if mailbox is None:
+                self.send(f"{tag} NO no such mailbox")
+                return True
+            self.mailbox, self.mailbox_name = mailbox, name
+            with server.lock:
+                self.exists = len(mailbox.messages)
+                self.send("* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)")
+                self.send(f"* {self.exists} EXISTS")
+                self.send("* 0 RECENT")
+                self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+                self.send(f"* OK [UIDNEXT {mailbox.next_uid}] predicted next UID")
+            mode = "READ-ONLY" if command == "EXAMINE" else "READ-WRITE"
+            self.send(f"{tag} OK [{mode}] {command} completed")
+            return True
+        elif command == "IDLE":
+            if not server.idle:
+                self.send(f"{tag} BAD IDLE not supported")
+                return True
+            return self.idle(tag)
+        elif command == "UID":
+            subcommand, _, args = args.partition(" ")
+            if subcommand.upper() == "SEARCH":
+                self.search(args)
+            elif subcommand.upper() == "FETCH":
+                self.fetch(args)
+            else:
+                self.send(f"{tag} BAD unsupported UID command")
+                return True
+        elif command == "CLOSE":
+            self.mailbox = None
+        elif command == "LOGOUT":
+            self.send("* BYE logging out")
+            self.send(f"{tag} OK LOGOUT completed")
+            return False
+        else:
+            self.send(f"{tag} BAD unsupported command")
+            return True
+        self.send(f"{tag} OK {command} completed")
+        return True
+
+    @staticmethod
+    def arguments(args):
+        """Splits command arguments into (value, was_quoted) pairs, ignoring parentheses."""
+        values = []
+        for quoted, paren, atom in ARG_RE.findall(args):
+            if paren:
+                continue
+            values.append((re.sub(r"\\(.)", r"\1", quoted), True) if atom == "" else (atom, False))
+        return values
+
+    def report_exists(self):
+        """Sends the new message count when mail arrived since the client last heard of it."""
+        if self.mailbox is None:
+            return
+        with self.server.imap.lock:
+            count = len(self.mailbox.messages)
+            if count != self.exists:
+                self.exists = count
+                self.send(f"* {count} EXISTS")
+
+    def idle(self, tag):
+        """Waits for DONE; new messages are pushed as untagged EXISTS responses by FakeIMAPServer.append."""
+        self.send("+ idling")
+        self.idling = True
+        self.report_exists()
+        try:
+            line = self.rfile.readline()
+        finally:
+            self.idling = False
+        if not line:
+            return False
+        if line.strip().upper() != b"DONE":
+            self.send(f"{tag} BAD expected DONE")
+            return True
+        self.send(f"{tag} OK IDLE terminated")
+        return True
+
+    def uid_set(self, text):
+        """The UIDs of the selected folder matching a sequence set such as "1:3,7,10:*"."""
+        with self.server.imap.lock:
+            uids = [message["uid"] for message in self.mailbox.messages]
+        highest = uids[-1] if uids else 0
+        selected = set()
+        for item in text.split(","):
+            lo, _, hi = item.partition(":")
+            lo = highest if lo == "*" else int(lo)
+            hi = lo if not hi else highest if hi == "*" else int(hi)
+            lo, hi = min(lo, hi), max(lo, hi)
+            selected.update(uid for uid in uids if lo <= uid <= hi)
+        return selected
+
+    def search(self, args):
+        tokens = [value for value, _ in self.arguments(args)]
+        if tokens[:1] and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        with self.server.imap.lock:
+            matches = {message["uid"]: message for message in self.mailbox.messages}
+        index = 0
+        while index < len(tokens):
+            key = tokens[index].upper()
+            if key == "UID":
+                allowed = self.uid_set(tokens[index + 1])
+                matches = {uid: m for uid, m in matches.items() if uid in allowed}
+                index += 1
+            elif key == "UNSEEN":
+                matches = {uid: m for uid, m in matches.items() if "\\Seen" not in m["flags"]}
+            elif key == "SEEN":
+                matches = {uid: m for uid, m in matches.items() if "\\Seen" in m["flags"]}
+            index += 1
+        self.send("* SEARCH" + "".join(f" {uid}" for uid in sorted(matches)))
+
+    def fetch(self, args):
+        uid_text, _, items = args.partition(" ")
+        items = items.strip()
+        if items.startswith("(") and items.endswith(")"):
+            items = items[1:-1]
+        requested = FETCH_ITEM_RE.findall(items)
+        uids = self.uid_set(uid_text)
+        with self.server.imap.lock:
+            messages = [(number, m) for number, m in enumerate(self.mailbox.messages, start=1) if m["uid"] in uids]
+        for number, message in messages:
+            response = [f"* {number} FETCH (UID {message['uid']}".encode()]
+            for body, section, offset, length, name in requested:
+                name = name.upper()
+                if name == "UID":
+                    continue
+                if name == "FLAGS":
+                    response.append(f" FLAGS ({' '.join(sorted(message['flags']))})".encode())
+                elif name == "BODYSTRUCTURE":
+                    response.append(f" BODYSTRUCTURE {bodystructure(message['parsed'])}".encode())
+                elif name == "RFC822.SIZE":
+                    response.append(f" RFC822.SIZE {len(message['raw'])}".encode())
+                elif name == "RFC822":
+                    response.append(f" RFC822 {{{len(message['raw'])}}}\r\n".encode() + message["raw"])
+                    message["flags"].add("\\Seen")
+                elif body:
+                    data = self.section(message, section)
+                    key = f"BODY[{section}]"
+                    if offset:
+                        data = data[int(offset):int(offset) + int(length)]
+                        key += f"<{offset}>"
+                    response.append(f" {key} {{{len(data)}}}\r\n".encode() + data)
+                    if body.upper() == "BODY":
+                        message["flags"].add("\\Seen")
+            response.append(b")")
+            self.send(b"".join(response))
+
+    @staticmethod
+    def section(message, section):
+        """The bytes of a body section: "", HEADER, HEADER.FIELDS (...), TEXT or a part number like 1.2."""
+        header, text = split_message(message["raw"])
+        spec = section.upper()
+        if spec == "":
+            return message["raw"]
+        if spec == "HEADER":
+            return header
+        if spec == "TEXT":
+            return text
+        if spec.startswith("HEADER.FIELDS"):
+            names = re.findall(r"[^\s()]+", section[section.index("(") + 1:])
+            return header_fields(header, names, exclude=spec.startswith("HEADER.FIELDS.NOT"))
+
+        part = message["parsed"]
+        for number in section.split("."):
+            if part.is_multipart():
+                children = part.get_payload()
+                index = int(number) - 1
+                if index >= len(children):
+                    return b""
+                part = children[index]
+            elif number != "1":
+                return b""
+        return part_payload(part)
+
+class FakeIMAPServer:
+    """A local IMAP stand-in (plain TCP, one thread per client) for running the sync code and the
+    IDLE daemon without a real mail account.
+
+    Messages added with append() are announced to IDLE clients at once; idle=False turns IDLE off to
+    exercise the NOOP-poll fallback, and disconnect_all() drops every client to exercise reconnects.
+    """
+
+    def __init__(self, users=None, folders=("INBOX",), host="127.0.0.1", port=0, idle=True):
+        self.users = users or {"user@example.com": "password"}
+        self.mailboxes = {name: Mailbox(uidvalidity=int(time.time()) + index) for index, name in enumerate(folders)}
+        self.idle = idle
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.stats = {"connections": 0, "commands": 0}
+        self.server = socketserver.ThreadingTCPServer((host, port), Session, bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.imap = self
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def account(self, folders=None):
+        """Account entry (as in accounts.json) for connecting to this server with the first user."""
+        host, port = self.address
+        user, password = next(iter(self.users.items()))
+        return {"user": user, "password": password, "host": host, "port": port, "ssl": False,
+                "folders": list(folders or self.mailboxes)}
+
+    def capabilities(self):
+        return ["IMAP4rev1", "IDLE"] if self.idle else ["IMAP4rev1"]
+
+    def count_command(self):
+        with self.lock:
+            self.stats["commands"] += 1
+
+    def sessions_add(self, session):
+        with self.lock:
+            self.sessions.add(session)
+            self.stats["connections"] += 1
+
+    def sessions_remove(self, session):
+        with self.lock:
+            self.sessions.discard(session)
+
+    def append(self, raw, folder="INBOX", seen=False):
+        """Delivers a raw message to a folder and returns its UID."""
+        parsed = email.message_from_bytes(raw)
+        with self.lock:
+            mailbox = self.mailboxes[folder]
+            uid = mailbox.next_uid
+            mailbox.next_uid += 1
+            mailbox.messages.append({"uid": uid, "flags": {"\\Seen"} if seen else set(), "raw": raw, "parsed": parsed})
+            idling = [session for session in self.sessions if session.idling and session.mailbox is mailbox]
+        for session in idling:
+            try:
+                session.report_exists()
+            except OSError:
+                pass
+        return uid
+
+    def disconnect_all(self):
+        """Drops every client connection, as a server restart or network failure would."""
+        with self.lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            try:
+                session.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        """Serves on a background thread and returns the (host, port) it listens on."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.address
+
+    def stop(self):
+        self.server.shutdown()
+        self.disconnect_all()
+        self.server.server_close()
+
+# run a stand-in server with demo mail, e.g. for: IMAP_HOST=127.0.0.1 IMAP_PORT=1143 IMAP_SSL=false
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Local IMAP stand-in server")
+    arg_parser.add_argument("--port", type=int, default=1143)
+    arg_parser.add_argument("--messages", type=int, default=5, help="messages in the INBOX at startup")
+    arg_parser.add_argument("--deliver-every", type=float, default=0, help="deliver a new message every N seconds")
+    arg_parser.add_argument("--no-idle", action="store_true", help="do not advertise IDLE (NOOP-poll clients)")
+    args = arg_parser.parse_args()
+
+    server = FakeIMAPServer(port=args.port, idle=not args.no_idle)
+    for number in range(1, args.messages + 1):
+        server.append(sample_message(number))
+    host, port = server.start()
+    account = server.account()
+    print(f"✅ IMAP stand-in on {host}:{port}, EMAIL_USER={account['user']} EMAIL_PASSWORD={account['password']}")
+
+    number = args.messages
+    try:
+        while True:
+            time.sleep(args.deliver_every or 3600)
+            if args.deliver_every:
+                number += 1
+                server.append(sample_message(number))
+                print(f"📧 Delivered message {number}")
+    except KeyboardInterrupt:
+        server.stop()
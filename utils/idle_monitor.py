@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+import select
+import ssl
+import threading
+import time
+from imap import connect, account_key
+from utils.telemetry import metrics
+
+# an IDLE command is renewed after this many seconds, servers may drop it after 30 minutes (RFC 2177)
+IDLE_RENEW_SECONDS = int(os.getenv("IMAP_IDLE_RENEW_SECONDS", 25 * 60))
+
+# seconds between two NOOPs on servers without IDLE
+POLL_SECONDS = int(os.getenv("IMAP_POLL_SECONDS", 30))
+
+# the wait before a reconnect doubles after every failure, up to this many seconds
+RECONNECT_MAX_SECONDS = int(os.getenv("IMAP_RECONNECT_MAX_SECONDS", 300))
+
+# mail arriving in several folders within this many seconds is processed as one batch
+DEBOUNCE_SECONDS = float(os.getenv("MONITOR_DEBOUNCE_SECONDS", 1.0))
+
+# seconds the server gets to answer the IDLE and DONE commands
+RESPONSE_TIMEOUT = 30
+
+EXISTS_RE = re.compile(rb"^\* \d+ EXISTS", re.I)
+
+logger = logging.getLogger(__name__)
+
+class FolderWatcher(threading.Thread):
+    """Keeps a dedicated connection on one folder and reports when new mail arrives.
+
+    The folder is watched with IDLE (implemented here, imaplib only speaks it from Python 3.14 on), or
+    polled with NOOP when the server does not advertise it. A lost connection is reopened with
+    exponential backoff, and every (re)connect is reported too, so mail that arrived meanwhile is synced.
+
+    The connection is the watcher's own, outside of the sync ConnectionPool: the daemon opens one per
+    watched folder on top of the IMAP_CONNECTIONS_PER_HOST of the sync.
+    """
+
+    def __init__(self, account, folder, on_change, stop_event, poll=False):
+        super().__init__(name=f"watch {account_key(account)}/{folder}", daemon=True)
+        self.account = account
+        self.folder = folder
+        self.on_change = on_change
+        self.stop_event = stop_event
+        self.poll = poll
+        self.buffer = b""
+
+    def run(self):
+        delay = 1
+        while not self.stop_event.is_set():
+            mail = None
+            try:
+                mail = connect(self.account)
+                # a partial line read from the dropped connection must not precede the new one's responses
+                self.buffer = b""
+                mail.select(self.folder, readonly=True)
+                use_idle = not self.poll and "IDLE" in mail.capabilities
+                logger.info(f"✅ Watching {account_key(self.account)}/{self.folder} with {'IDLE' if use_idle else 'NOOP polling'}")
+                delay = 1
+                self.on_change(self.account, self.folder)
+                while not self.stop_event.is_set():
+                    if self._idle(mail) if use_idle else self._poll(mail):
+                        self.on_change(self.account, self.folder)
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                metrics.count("email_imap_reconnects_total")
+                logger.warning(f"❌ Lost {account_key(self.account)}/{self.folder}: {e}, reconnecting in {delay}s")
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+
+    def _poll(self, mail):
+        """Waits POLL_SECONDS, then sends a NOOP; True when the server reported a new message count."""
+        if self.stop_event.wait(POLL_SECONDS):
+            return False
+        mail.noop()
+        return mail.response("EXISTS")[1][0] is not None
+
+    def _read_line(self, mail, timeout, interruptible=True):
+        """Reads one response line straight from the socket, or returns None at the timeout or on shutdown.
+
+        The socket is polled with select so the watcher wakes up every second to check for shutdown.
+        """
+        deadline = time.monotonic() + timeout
+        while b"\r\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (interruptible and self.stop_event.is_set()):
+                return None
+            # TLS may already hold decrypted bytes that select does not see
+            if not (isinstance(mail.sock, ssl.SSLSocket) and mail.sock.pending()):
+                readable, _, _ = select.select([mail.sock], [], [], min(remaining, 1.0))
+                if not readable:
+                    continue
+            try:
+                data = mail.sock.recv(65536)
+            except ssl.SSLWantReadError:
+                continue
+            if not data:
+                raise ConnectionError("connection closed by the server")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\r\n", 1)
+        return line
+
+    def _idle(self, mail):
+        """Runs one IDLE command until new mail, renewal time or shutdown; True when new mail arrived."""
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        line = self._read_line(mail, RESPONSE_TIMEOUT, interruptible=False)
+        if line is None or not line.startswith(b"+"):
+            raise ConnectionError(f"IDLE refused: {line!r}")
+
+        new_mail = False
+        while not new_mail:
+            line = self._read_line(mail, IDLE_RENEW_SECONDS)
+            if line is None:
+                break
+            if line.startswith(b"* BYE"):
+                raise ConnectionError(line.decode("utf-8", "replace"))
+            new_mail = bool(EXISTS_RE.match(line))
+
+        # end the IDLE so the connection is usable again, responses sent meanwhile are drained
+        mail.send(b"DONE\r\n")
+        while True:
+            line = self._read_line(mail, RESPONSE_TIMEOUT, interruptible=False)
+            if line is None:
+                raise ConnectionError("no response to DONE")
+            if line.startswith(tag):
+                break
+            new_mail = new_mail or bool(EXISTS_RE.match(line))
+        return new_mail
+
+class MailboxMonitor:
+    """Watches every account and folder and calls process with the folders that received new mail.
+
+    process runs on the thread calling run(), one batch at a time, so the pipeline behind it never sees
+    two batches at once; folders changing while a batch runs are collected into the next one.
+    """
+
+    def __init__(self, accounts, process, poll=False, debounce=DEBOUNCE_SECONDS):
+        self.accounts = accounts
+        self.process = process
+        self.poll = poll
+        self.debounce = debounce
+        self.stop_event = threading.Event()
+        self.changed = threading.Event()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.watchers = []
+
+    def notify(self, account, folder):
+        """Marks a folder as having new mail, called by the watcher threads."""
+        with self.lock:
+            self.pending[(account_key(account), folder)] = (account, folder)
+        self.changed.set()
+
+    def run(self):
+        """Starts the watchers and processes new mail until stop() is called."""
+        self.watchers = [
+            FolderWatcher(account, folder, self.notify, self.stop_event, self.poll)
+            for account in self.accounts for folder in account["folders"]
+        ]
+        for watcher in self.watchers:
+            watcher.start()
+
+        while not self.stop_event.is_set():
+            if not self.changed.wait(timeout=1.0):
+                continue
+            # let mail arriving in other folders at the same moment join the batch
+            self.stop_event.wait(self.debounce)
+            with self.lock:
+                folders = list(self.pending.values())
+                self.pending = {}
+                self.changed.clear()
+            try:
+                self.process(folders)
+            except Exception as e:
+                logger.exception(f"❌ Error processing new mail: {e}")
+
+        for watcher in self.watchers:
+            watcher.join(timeout=RESPONSE_TIMEOUT)
+
+    def stop(self):
+        """Asks the watchers and the processing loop to finish; the batch being processed is completed."""
+        self.stop_event.set()
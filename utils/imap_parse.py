@@ -0,0 +1,158 @@
+import base64
+import binascii
+import codecs
+import re
+
+# a quoted string, a literal marker, a parenthesis or an atom (sections like BODY[1.2]<0> are one atom)
+TOKEN_RE = re.compile(rb'\s*(?:"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([()])|((?:[^\s()"\[]|\[[^\]]*\])+))')
+
+def _tokenize(data):
+    """Turns the raw response of imaplib into a flat list of tokens, with literals as bytes tokens."""
+    tokens = []
+    for item in data:
+        text, literal = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+        if text is None:
+            continue
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
+                break
+            quoted, literal_size, paren, atom = match.groups()
+            if quoted is not None:
+                tokens.append(("string", re.sub(rb'\\(.)', rb'\1', quoted)))
+            elif literal_size is not None:
+                tokens.append(("string", literal or b""))
+                literal = None
+            elif paren is not None:
+                tokens.append(("paren", paren))
+            else:
+                tokens.append(("atom", atom))
+            pos = match.end()
+    return tokens
+
+def _parse_list(tokens, pos):
+    """Parses tokens from pos up to the matching closing parenthesis into nested lists."""
+    items = []
+    while pos < len(tokens):
+        kind, value = tokens[pos]
+        pos += 1
+        if kind == "paren" and value == b"(":
+            value, pos = _parse_list(tokens, pos)
+            items.append(value)
+        elif kind == "paren":
+            return items, pos
+        elif kind == "atom":
+            items.append(None if value.upper() == b"NIL" else value.decode("ascii", "replace"))
+        else:
+            items.append(value)
+    return items, pos
+
+def parse_fetch_response(data):
+    """Parses the data of a (UID) FETCH command into one {ITEM: value} dict per message.
+
+    Body sections are keyed without their partial origin, e.g. "BODY[1]<0>" --> "BODY[1]".
+    """
+    tokens = _tokenize(data)
+    messages = []
+    pos = 0
+    while pos < len(tokens):
+        # every message starts with "<sequence number> ("
+        if tokens[pos][0] != "atom" or pos + 1 >= len(tokens) or tokens[pos + 1] != ("paren", b"("):
+            pos += 1
+            continue
+        items, pos = _parse_list(tokens, pos + 2)
+        message = {}
+        for name, value in zip(items[::2], items[1::2]):
+            name = re.sub(r"<\d+>$", "", name.upper())
+            message[name] = value
+        messages.append(message)
+    return messages
+
+def _text(value):
+    """Returns a BODYSTRUCTURE string field as str."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+def _params(value):
+    """Turns a BODYSTRUCTURE ("KEY" "value" ...) list into a lower-cased dict."""
+    if not isinstance(value, list):
+        return {}
+    return {_text(k).lower(): _text(v) for k, v in zip(value[::2], value[1::2])}
+
+def walk_bodystructure(structure, prefix=""):
+    """Yields every leaf part of a BODYSTRUCTURE with its section number, type, encoding, size and filename."""
+    if structure and isinstance(structure[0], list):
+        # multipart: child parts followed by the subtype and extension data
+        children = []
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            children.append(child)
+        for index, child in enumerate(children, start=1):
+            yield from walk_bodystructure(child, f"{prefix}{index}.")
+        return
+
+    content_type = f"{_text(structure[0])}/{_text(structure[1])}".lower()
+    params = _params(structure[2])
+    extension = structure[8:] if content_type.startswith("text/") else structure[7:]
+    if content_type == "message/rfc822":
+        extension = structure[10:]
+    disposition = extension[1] if len(extension) > 1 and isinstance(extension[1], list) else None
+    disposition_params = _params(disposition[1]) if disposition and len(disposition) > 1 else {}
+    yield {
+        "section": prefix.rstrip(".") or "1",
+        "content_type": content_type,
+        "charset": params.get("charset"),
+        "encoding": (_text(structure[5]) or "7bit").lower(),
+        "size": int(structure[6] or 0),
+        "disposition": _text(disposition[0]).lower() if disposition else None,
+        "filename": disposition_params.get("filename") or params.get("name"),
+    }
+
+def find_text_part(parts):
+    """Picks the body part to read: the first inline text/plain part, else the first inline text/html part."""
+    inline_parts = [part for part in parts if part["disposition"] != "attachment"]
+    for content_type in ("text/plain", "text/html"):
+        for part in inline_parts:
+            if part["content_type"] == content_type:
+                return part
+    return None
+
+def decode_part(data, encoding, charset):
+    """Decodes the (possibly truncated) bytes of a body part using its transfer encoding and charset."""
+    if encoding == "base64":
+        data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        # a partial fetch can stop in the middle of a base64 quantum
+        data = data[:len(data) - len(data) % 4]
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error:
+            data = b""
+    elif encoding == "quoted-printable":
+        data = binascii.a2b_qp(data)
+    return decode_text(data, charset)
+
+def decode_text(data, charset):
+    """Decodes text with its declared charset, falling back to UTF-8 and then Windows-1252 when the
+    charset is unknown or does not match the bytes (mislabelled parts are common).
+
+    A character cut in half at the end of a partial fetch is dropped instead of failing the charset.
+    """
+    for candidate in (charset, "utf-8", "cp1252"):
+        if not candidate:
+            continue
+        try:
+            return codecs.getincrementaldecoder(candidate)().decode(data, final=False)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return data.decode(charset if charset and _known(charset) else "utf-8", errors="replace")
+
+def _known(charset):
+    try:
+        codecs.lookup(charset)
+        return True
+    except LookupError:
+        return False
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+from contextlib import closing
+from pydantic import Field, TypeAdapter, ValidationError, create_model
+from utils.telemetry import metrics, span
+
+# how long ollama keeps the model loaded after a request, a duration ("30m") or seconds ("-1" never unloads it)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# tokens generated at most per email, a runaway generation is cut there
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", 256))
+
+logger = logging.getLogger(__name__)
+
+# appended to the prompt in batch mode. no curly braces, the prompt is a format string
+BATCH_INSTRUCTIONS = """
+              ### **Batch Mode**: The email data above is a JSON array of emails, each with an "id".
+                - Return a JSON object with an "emails" array containing one object per email, in the output format above.
+                - Add the "id" of the input email to each object, and never merge or skip emails.
+          """
+
+def batch_schema(schema):
+    """Builds the response model of a batch request: {"emails": [schema + "id", ...]}."""
+    item = create_model(
+        f"{schema.__name__}Item", __base__=schema, id=(str, Field(..., description="Id of the input email"))
+    )
+    return create_model(f"{schema.__name__}Batch", emails=(list[item], Field(..., description="One entry per email")))
+
+def partial_error(adapter, text):
+    """Returns why a partial JSON response can no longer validate whatever the model generates next, or None.
+
+    Fields not generated yet are reported as missing by the partial validation and are ignored.
+    """
+    if not text.strip():
+        return None
+    try:
+        adapter.validate_json(text, experimental_allow_partial=True)
+    except ValidationError as e:
+        for error in e.errors():
+            if error["type"] != "missing":
+                return f"{error['msg']} at {'.'.join(map(str, error['loc'])) or 'the start'}"
+    return None
+
+def batch_payload(batch):
+    """Serializes a list of (id, email_data) pairs into the JSON array passed as email_data."""
+    return json.dumps([{"id": email_id, **email_data} for email_id, email_data in batch], default=str)
+
+class GeminiBackend:
+    """Classifies emails with generate_content, with the pydantic schema as response_schema."""
+
+    def __init__(self, client, model_name, prompt, schema):
+        self.client = client
+        self.model_name = model_name
+        self.prompt = prompt
+        self.schema = schema
+        self.batch_prompt = prompt + BATCH_INSTRUCTIONS
+        self.batch_schema = batch_schema(schema)
+
+    def _generate(self, contents, schema):
+        with span("model", backend="gemini"):
+            response = self.client.models.generate_content(
+                model = self.model_name,
+                contents = contents,
+                config={
+                    'response_mime_type': 'application/json',
+                    'response_schema': schema
+                }
+            )
+        with span("validate", backend="gemini"):
+            if response.parsed is None:
+                raise ValueError(f"Invalid response from the model: {response.text}")
+            return json.loads(response.parsed.json())
+
+    def classify(self, email_data):
+        with span("prompt", backend="gemini"):
+            contents = self.prompt.format(email_data=email_data)
+        return self._generate(contents, self.schema)
+
+    def classify_batch(self, batch):
+        """Classifies a list of (id, email_data) pairs in one request, returns the parsed dicts with their "id"."""
+        with span("prompt", backend="gemini", emails=len(batch)):
+            contents = self.batch_prompt.format(email_data=batch_payload(batch))
+        return self._generate(contents, self.batch_schema)["emails"]
+
+class OllamaBackend:
+    """Classifies emails with generate on one ollama client shared by all requests.
+
+    The pydantic schema is passed as the JSON schema format so the output is constrained to it. The response
+    is streamed and validated as it grows: a generation that can no longer validate is aborted at once
+    instead of being finished and rejected. The model stays loaded for keep_alive, warm_up() loads it
+    before the first email.
+    """
+
+    def __init__(self, client, model_name, prompt, schema, keep_alive=OLLAMA_KEEP_ALIVE, num_predict=OLLAMA_NUM_PREDICT):
+        self.client = client
+        self.model_name = model_name
+        self.prompt = prompt
+        self.schema = schema
+        self.batch_prompt = prompt + BATCH_INSTRUCTIONS
+        self.batch_schema = batch_schema(schema)
+        self.adapter = TypeAdapter(schema)
+        self.batch_adapter = TypeAdapter(self.batch_schema)
+        # ollama reads a number as seconds and a string as a duration
+        self.keep_alive = int(keep_alive) if str(keep_alive).lstrip("-").isdigit() else keep_alive
+        self.num_predict = num_predict
+
+    def warm_up(self):
+        """Loads the model into memory, so the first email does not wait for it."""
+        try:
+            response = self.client.generate(model=self.model_name, prompt="", keep_alive=self.keep_alive)
+            logger.info(f"✅ {self.model_name} loaded in {response['load_duration'] / 1e9:.1f}s, kept for {self.keep_alive}")
+        except Exception as e:
+            logger.warning(f"❌ Could not load {self.model_name}: {e}")
+
+    def _generate(self, prompt, adapter, emails=1):
+        with span("model", backend="ollama"):
+            stream = self.client.generate(
+                model=self.model_name,
+                prompt=prompt,
+                format=adapter.json_schema(),
+                stream=True,
+                keep_alive=self.keep_alive,
+                options={"num_predict": self.num_predict * emails},
+            )
+            text = ""
+            # closing the stream drops the connection, which stops the generation on the server
+            with closing(stream):
+                for chunk in stream:
+                    text += chunk["response"]
+                    error = partial_error(adapter, text)
+                    if error:
+                        metrics.count("email_llm_aborted_total", backend="ollama")
+                        raise ValueError(f"Generation aborted, {error}: {text}")
+        with span("validate", backend="ollama"):
+            return adapter.validate_json(text).model_dump()
+
+    def classify(self, email_data):
+        with span("prompt", backend="ollama"):
+            prompt = self.prompt.format(email_data=email_data)
+        return self._generate(prompt, self.adapter)
+
+    def classify_batch(self, batch):
+        """Classifies a list of (id, email_data) pairs in one request, returns the parsed dicts with their "id"."""
+        with span("prompt", backend="ollama", emails=len(batch)):
+            prompt = self.batch_prompt.format(email_data=batch_payload(batch))
+        return self._generate(prompt, self.batch_adapter, len(batch))["emails"]
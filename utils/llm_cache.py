@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from utils.telemetry import metrics
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+
+# size limit of the cached responses, least recently used entries are evicted above it
+LLM_CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", 100)) * 1024 * 1024)
+
+def content_hash(*parts):
+    """Returns the sha256 hex digest of the given values, serialized as JSON."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def normalize_content(email_data):
+    """Collapses whitespace so emails that only differ in line breaks or indentation share a cache entry."""
+    if isinstance(email_data, dict):
+        return {key: normalize_content(value) for key, value in email_data.items()}
+    return " ".join(str(email_data).split())
+
+class LLMCache:
+    """Persistent SQLite cache of validated model responses, keyed by email content, prompt and model.
+
+    Entries are evicted least recently used first once the stored responses exceed max_bytes.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def key(namespace, email_data):
+        """Builds the cache key of an email; the namespace identifies the prompt version and model."""
+        return content_hash(namespace, normalize_content(email_data))
+
+    def get(self, namespace, email_data):
+        """Returns the cached response of an email, or None."""
+        key = self.key(namespace, email_data)
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.count("email_llm_cache_total", result="miss")
+                return None
+            self.hits += 1
+            metrics.count("email_llm_cache_total", result="hit")
+            self.conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, namespace, email_data, response):
+        """Stores the response of an email and evicts the least recently used entries above max_bytes."""
+        key = self.key(namespace, email_data)
+        value = json.dumps(response)
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self.size += len(value) - (row[0] if row else 0)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            while self.size > self.max_bytes:
+                oldest = self.conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used LIMIT 100").fetchall()
+                if not oldest:
+                    break
+                for old_key, old_size in oldest:
+                    if self.size <= self.max_bytes:
+                        break
+                    self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                    self.size -= old_size
+            self.conn.commit()
+
+    def stats(self):
+        """Returns the hit/miss counters and the stored size."""
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size}
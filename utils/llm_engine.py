@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.tokens import estimate_tokens
+from utils.llm_cache import content_hash
+from utils.telemetry import metrics
+
+# HTTP status codes worth retrying: timeouts, rate limits and server errors
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# a 400 error with this in its message means the request was too large, a smaller batch may pass
+TOO_LARGE_RE = re.compile(r"too (large|long)|exceed|context length|maximum.*tokens", re.I)
+
+logger = logging.getLogger(__name__)
+
+def prompt_data(email_data):
+    """The part of a fetched email sent to the model: everything but the "meta" fetch details."""
+    return {key: value for key, value in email_data.items() if key != "meta"}
+
+def passthrough(email_data):
+    """Fields copied from the fetched email into the result instead of being echoed by the model."""
+    meta = email_data.get("meta") or {}
+    return {
+        "message_id": meta.get("message_id"),
+        "thread_id": meta.get("thread_id"),
+        "date": meta.get("date"),
+        "to": email_data.get("to"),
+        "from_": email_data.get("from"),
+        "cc": email_data.get("cc"),
+        "bcc": email_data.get("bcc"),
+        "subject": email_data.get("subject"),
+        "body": email_data.get("body"),
+    }
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def is_transient(error):
+    """Tells whether a failed model call is worth retrying (rate limit, server error, timeout, dropped connection)."""
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if status in TRANSIENT_STATUS_CODES:
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # httpx errors raised by the gemini and ollama clients
+    return type(error).__name__ in ("ConnectError", "ConnectTimeout", "ReadTimeout", "RemoteProtocolError")
+
+def is_malformed(error):
+    """Tells whether a failed batch is worth splitting: the response did not validate or parse, or the request was too large.
+
+    Other errors (authentication, unknown model, quota) fail every smaller batch just the same.
+    """
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if status == 400:
+        return bool(TOO_LARGE_RE.search(str(error)))
+    # pydantic validation and JSON errors are ValueErrors, a response of the wrong shape raises the others
+    return status is None and isinstance(error, (ValueError, KeyError, TypeError, AttributeError))
+
+class ClassificationEngine:
+    """Runs a backend's classify(email_data) on a thread pool with a concurrency limit, rate limiting and retries.
+
+    A backend is any object with prompt and model_name strings and a classify(email_data) method returning
+    the model's insights (tags, summary) as a dict, see utils/llm_backends.py. The addresses, subject and
+    body of the result are copied from the email, the model never echoes them. With a batch_tokens budget, emails are packed into
+    batches sent with the backend's classify_batch([(id, email_data), ...]). With a PreClassifier, emails
+    with obvious tags never reach the model, and with an LLMCache, emails already classified with the same
+    prompt and model are answered from it.
+    """
+
+    def __init__(self, backend, concurrency=None, requests_per_minute=None, max_retries=None, backoff=1.0,
+                 batch_tokens=None, cache=None, preclassifier=None):
+        # the settings left out are read from the environment here, not at import, so a .env loaded
+        # by the entry point counts
+        if concurrency is None:
+            # number of requests sent to the model at the same time
+            concurrency = int(os.getenv("LLM_CONCURRENCY", 4))
+        if requests_per_minute is None:
+            # provider quota, 0 means unlimited
+            requests_per_minute = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 0))
+        if max_retries is None:
+            # retries of a request that failed with a transient error
+            max_retries = int(os.getenv("LLM_MAX_RETRIES", 3))
+        if batch_tokens is None:
+            # token budget of one batched request (prompt + packed emails), 0 sends one email per request
+            batch_tokens = int(os.getenv("LLM_BATCH_TOKENS", 0))
+        self.backend = backend
+        self.cache = cache
+        self.preclassifier = preclassifier
+        # a prompt edit or a model switch invalidates the cached responses
+        self.cache_namespace = f"{backend.model_name}:{content_hash(backend.prompt)[:16]}"
+        self.concurrency = concurrency
+        self.batch_tokens = batch_tokens
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = TokenBucket(requests_per_minute / 60) if requests_per_minute else None
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "batch_splits": 0, "prompt_tokens": 0,
+                      "output_tokens": 0, "passthrough_tokens": 0}
+        self.stats_lock = threading.Lock()
+        # emails of the last classify_all that got no result, see SyncState.hold_back
+        self.failed = []
+
+    def _count(self, name, value=1):
+        with self.stats_lock:
+            self.stats[name] += value
+        metrics.count(f"email_llm_{name}_total", value)
+
+    def call(self, fn, *args):
+        """Calls fn(*args) under the rate limit, retrying transient errors with exponential backoff and jitter."""
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            self._count("requests")
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                self._count("retries")
+                delay = self.backoff * 2 ** attempt
+                time.sleep(delay + random.uniform(0, delay))
+
+    def classify(self, email_data):
+        """Classifies one email, returns the parsed dict or None when it failed."""
+        return self.classify_batch([email_data])[0]
+
+    def classify_batch(self, emails):
+        """Classifies a list of emails, returns the parsed dicts (None for failed ones) in input order.
+
+        Pre-classified and cached emails are answered locally, the others are sent in one request.
+        """
+        originals = emails
+        results = [None] * len(emails)
+        if self.preclassifier is not None:
+            results = [self.preclassifier.classify(email_data) for email_data in emails]
+        emails = [prompt_data(email_data) for email_data in emails]
+        if self.cache is not None:
+            results = [
+                result if result is not None else self.cache.get(self.cache_namespace, email_data)
+                for result, email_data in zip(results, emails)
+            ]
+
+        misses = [index for index, result in enumerate(results) if result is None]
+        if misses:
+            responses = self._request_batch([emails[index] for index in misses])
+            for index, response in zip(misses, responses):
+                if response is not None and self.cache is not None:
+                    self.cache.put(self.cache_namespace, emails[index], response)
+                if response is not None:
+                    self._count("passthrough_tokens", estimate_tokens(passthrough(emails[index])))
+                results[index] = response
+
+        return [
+            {**passthrough(email_data), **result} if result is not None else None
+            for email_data, result in zip(originals, results)
+        ]
+
+    def _request(self, email_data):
+        """Sends one email to the model, returns the parsed dict or None when it failed."""
+        try:
+            self._count("prompt_tokens", estimate_tokens(self.backend.prompt) + estimate_tokens(email_data))
+            response = self.call(self.backend.classify, email_data)
+            self._count("output_tokens", estimate_tokens(json.dumps(response)))
+            return response
+        except Exception as e:
+            self._count("failures")
+            logger.error(f"❌ Error processing email: {e}")
+            return None
+
+    def _request_batch(self, emails):
+        """Sends a list of emails to the model in one request, returns the parsed dicts in input order.
+
+        When the response is malformed or misses emails, the batch is split in half and each half is retried,
+        so a single bad email does not lose the whole batch. Any other error fails the whole batch.
+        """
+        if len(emails) == 1:
+            return [self._request(emails[0])]
+
+        batch = [(str(index), email_data) for index, email_data in enumerate(emails)]
+        try:
+            self._count("prompt_tokens", estimate_tokens(self.backend.prompt) + sum(estimate_tokens(e) for e in emails))
+            responses = self.call(self.backend.classify_batch, batch)
+            self._count("output_tokens", estimate_tokens(json.dumps(responses)))
+            results = {result.pop("id", None): result for result in responses}
+            if all(email_id in results for email_id, _ in batch):
+                return [results[email_id] for email_id, _ in batch]
+            error = f"response has {len(results)} of {len(batch)} emails"
+        except Exception as e:
+            if not is_malformed(e):
+                self._count("failures", len(emails))
+                logger.error(f"❌ Error processing batch of {len(emails)} emails: {e}")
+                return [None] * len(emails)
+            error = e
+
+        logger.warning(f"❌ Malformed batch response ({error}), splitting the batch of {len(emails)} emails")
+        self._count("batch_splits")
+        middle = len(emails) // 2
+        return self._request_batch(emails[:middle]) + self._request_batch(emails[middle:])
+
+    def batches(self, emails):
+        """Packs an iterable of emails into lists that fit the token budget with the prompt, one email minimum."""
+        budget = self.batch_tokens - estimate_tokens(self.backend.prompt)
+        batch, batch_tokens = [], 0
+        for email_data in emails:
+            tokens = estimate_tokens(prompt_data(email_data))
+            if batch and batch_tokens + tokens > budget:
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(email_data)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def classify_all(self, emails):
+        """Classifies an iterable of emails concurrently and returns the parsed ones, in input order.
+
+        At most twice the concurrency limit of requests is in flight, so a streaming iterable is never read ahead further.
+        The emails that failed are left in self.failed.
+        """
+        batches = self.batches(emails) if self.batch_tokens else ([email_data] for email_data in emails)
+        processed_emails = []
+        self.failed = []
+        pending = deque()
+
+        def collect(batch, future):
+            for email_data, result in zip(batch, future.result()):
+                processed_emails.append(result)
+                if result is None:
+                    self.failed.append(email_data)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for batch in batches:
+                pending.append((batch, executor.submit(self.classify_batch, batch)))
+                if len(pending) >= self.concurrency * 2:
+                    collect(*pending.popleft())
+            while pending:
+                collect(*pending.popleft())
+
+        logger.info(
+            f"LLM requests: {self.stats['requests']}, retries: {self.stats['retries']}, "
+            f"failures: {self.stats['failures']}, batch splits: {self.stats['batch_splits']}, "
+            f"estimated prompt tokens: {self.stats['prompt_tokens']}, output tokens: {self.stats['output_tokens']} "
+            f"({self.stats['passthrough_tokens']} passed through instead of echoed)"
+        )
+        if self.cache is not None:
+            logger.info(f"LLM cache: {self.cache.stats()}")
+        if self.preclassifier is not None:
+            logger.info(f"Pre-classifier: {self.preclassifier.stats}, handled locally: {self.preclassifier.local_fraction():.0%}")
+        return [email for email in processed_emails if email is not None]
@@ -0,0 +1,252 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from email.parser import BytesHeaderParser
+
+# decoded parts larger than this are spooled to a temporary file instead of being kept in memory
+MIME_SPOOL_BYTES = int(os.getenv("MIME_SPOOL_BYTES", 1024 * 1024))
+
+# bytes of a message read at most, the rest is neither downloaded nor parsed
+MIME_MAX_MESSAGE_BYTES = int(os.getenv("MIME_MAX_MESSAGE_BYTES", 50 * 1024 * 1024))
+
+# decoded bytes of one part that are hashed and kept, a larger part is marked truncated
+MIME_MAX_PART_BYTES = int(os.getenv("MIME_MAX_PART_BYTES", 25 * 1024 * 1024))
+
+# decoded bytes of the text part read into the body of an email
+MIME_TEXT_BYTES = int(os.getenv("MIME_TEXT_BYTES", 1024 * 1024))
+
+# header block of a message or part read at most
+MAX_HEADER_BYTES = 256 * 1024
+
+# a line without a line break is handed to the part in pieces of this size
+MAX_LINE_BYTES = 64 * 1024
+
+BASE64_JUNK_RE = re.compile(rb"[^A-Za-z0-9+/=]")
+
+class Base64Decoder:
+    """Decodes base64 fed in arbitrary pieces, carrying incomplete quanta to the next piece."""
+
+    def __init__(self):
+        self.carry = b""
+
+    def __call__(self, data):
+        data = self.carry + BASE64_JUNK_RE.sub(b"", data)
+        end = len(data) - len(data) % 4
+        self.carry = data[end:]
+        try:
+            return base64.b64decode(data[:end])
+        except binascii.Error:
+            return b""
+
+def quoted_printable(data):
+    """Decodes one line of quoted-printable (a soft line break "=" at its end joins it to the next)."""
+    return binascii.a2b_qp(data)
+
+class SpooledPart:
+    """A leaf MIME part decoded as it streams in: its size and SHA-256 are always recorded, and its bytes
+    are only kept (in memory up to MIME_SPOOL_BYTES, then in a temporary file) when keep is set.
+
+    Bytes past max_bytes are counted in the size but neither hashed nor kept, and the part is marked
+    truncated (its hash is then unknown).
+    """
+
+    def __init__(self, headers, keep=False, max_bytes=MIME_MAX_PART_BYTES, spool_bytes=MIME_SPOOL_BYTES):
+        self.content_type = headers.get_content_type()
+        self.charset = headers.get_content_charset()
+        self.disposition = headers.get_content_disposition()
+        self.filename = headers.get_filename()
+        encoding = str(headers.get("Content-Transfer-Encoding") or "7bit").strip().lower()
+        self.decode = Base64Decoder() if encoding == "base64" else quoted_printable if encoding == "quoted-printable" else None
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+        self.hash = hashlib.sha256()
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_bytes) if keep else None
+
+    def write(self, data):
+        if self.decode is not None:
+            data = self.decode(data)
+        room = self.max_bytes - self.size
+        self.size += len(data)
+        if len(data) > room:
+            self.truncated = True
+            data = data[:max(room, 0)]
+        if data:
+            self.hash.update(data)
+            if self.file is not None:
+                self.file.write(data)
+
+    def read(self, limit=-1):
+        """Returns the first limit decoded bytes of a kept part."""
+        if self.file is None:
+            return b""
+        self.file.seek(0)
+        return self.file.read(limit)
+
+    def metadata(self):
+        return {
+            "content_type": self.content_type,
+            "filename": self.filename,
+            "size": self.size,
+            "sha256": None if self.truncated else self.hash.hexdigest(),
+            "truncated": self.truncated,
+        }
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+class MimeStreamParser:
+    """Splits a MIME message fed in chunks into its headers and leaf parts without holding it in memory.
+
+    Only header blocks and the current line are buffered; the body of every leaf part goes through a
+    SpooledPart. The first inline text/plain and text/html parts are kept so the body can be read,
+    attachments only keep their metadata unless keep_attachments is set. Input past max_message_bytes
+    is ignored and the message marked truncated. Call cleanup() to delete the spooled files.
+    """
+
+    def __init__(self, max_message_bytes=MIME_MAX_MESSAGE_BYTES, max_part_bytes=MIME_MAX_PART_BYTES,
+                 spool_bytes=MIME_SPOOL_BYTES, keep_attachments=False):
+        self.max_message_bytes = max_message_bytes
+        self.max_part_bytes = max_part_bytes
+        self.spool_bytes = spool_bytes
+        self.keep_attachments = keep_attachments
+        self.headers = None
+        self.parts = []
+        self.truncated = False
+        self.received = 0
+        self.buffer = b""
+        self.header_lines = []
+        self.header_bytes = 0
+        self.boundaries = []
+        # "header", "body" (of a leaf part) or "skip" (multipart preamble/epilogue)
+        self.state = "header"
+        self.part = None
+        self.pending_eol = b""
+        self.line_start = True
+
+    def feed(self, data):
+        if self.received >= self.max_message_bytes:
+            self.truncated = True
+            return
+        if self.received + len(data) > self.max_message_bytes:
+            data = data[:self.max_message_bytes - self.received]
+            self.truncated = True
+        self.received += len(data)
+        self.buffer += data
+
+        start = 0
+        while True:
+            if self.state == "body" and self.line_start and not self.buffer.startswith(b"-", start):
+                # everything up to the next line starting with "--" is body, it is handed over in one piece
+                end = self.buffer.find(b"\n--", start) if self.boundaries else -1
+                end = self.buffer.rfind(b"\n", start) if end == -1 else end
+                if end > start:
+                    self._body(self.buffer[start:end + 1])
+                    start = end + 1
+            end = self.buffer.find(b"\n", start)
+            if end == -1:
+                break
+            self._line(self.buffer[start:end + 1], self.line_start)
+            self.line_start = True
+            start = end + 1
+        self.buffer = self.buffer[start:]
+        # very long lines (unwrapped base64) are passed on in pieces, they can not be boundaries
+        if len(self.buffer) > MAX_LINE_BYTES:
+            self._line(self.buffer, self.line_start)
+            self.line_start = False
+            self.buffer = b""
+
+    def close(self):
+        """Ends the input; returns self with headers and parts filled in."""
+        if self.buffer:
+            self._line(self.buffer, self.line_start)
+            self.buffer = b""
+        if self.state == "header":
+            self._end_headers()
+        self._end_part()
+        return self
+
+    def _line(self, line, line_start):
+        if line_start and self.boundaries and line.startswith(b"--"):
+            marker = line.rstrip()
+            for depth in range(len(self.boundaries) - 1, -1, -1):
+                delimiter = b"--" + self.boundaries[depth]
+                if marker == delimiter or marker == delimiter + b"--":
+                    self._end_part()
+                    if self.state == "header":
+                        # a part without body (its headers end at the boundary)
+                        self._end_headers()
+                        self._end_part()
+                    del self.boundaries[depth + 1:]
+                    if marker == delimiter:
+                        self.state = "header"
+                    else:
+                        self.boundaries.pop()
+                        self.state = "skip"
+                    return
+
+        if self.state == "header":
+            if line.strip() == b"":
+                self._end_headers()
+            elif self.header_bytes < MAX_HEADER_BYTES:
+                self.header_lines.append(line)
+                self.header_bytes += len(line)
+        elif self.state == "body":
+            self._body(line)
+
+    def _body(self, data):
+        """Writes body lines to the current part; the line break before a boundary belongs to the boundary,
+        so the last one is held back until the next line is seen."""
+        body, eol = (data[:-2], data[-2:]) if data.endswith(b"\r\n") else (data[:-1], data[-1:]) if data.endswith(b"\n") else (data, b"")
+        if self.part.decode is quoted_printable and body.rstrip().endswith(b"="):
+            # soft line break, the line continues on the next one
+            body, eol = body.rstrip()[:-1], b""
+        self.part.write(self.pending_eol + body)
+        self.pending_eol = eol
+
+    def _end_headers(self):
+        headers = BytesHeaderParser().parsebytes(b"".join(self.header_lines))
+        self.header_lines, self.header_bytes = [], 0
+        if self.headers is None:
+            self.headers = headers
+
+        boundary = headers.get_boundary() if headers.get_content_maintype() == "multipart" else None
+        if boundary:
+            self.boundaries.append(boundary.encode("utf-8", "replace"))
+            self.state = "skip"
+            return
+
+        inline = headers.get_content_disposition() != "attachment"
+        content_type = headers.get_content_type()
+        keep = self.keep_attachments or (
+            inline and content_type in ("text/plain", "text/html")
+            and not any(part.content_type == content_type and part.file is not None for part in self.parts)
+        )
+        self.part = SpooledPart(headers, keep, self.max_part_bytes, self.spool_bytes)
+        self.pending_eol = b""
+        self.state = "body"
+
+    def _end_part(self):
+        if self.part is not None:
+            self.parts.append(self.part)
+            self.part = None
+        self.pending_eol = b""
+
+    def text_part(self):
+        """The part to read the body from: the first inline text/plain part, else the first inline text/html part."""
+        for content_type in ("text/plain", "text/html"):
+            for part in self.parts:
+                if part.content_type == content_type and part.file is not None and part.disposition != "attachment":
+                    return part
+        return None
+
+    def cleanup(self):
+        """Deletes the spooled temporary files."""
+        for part in self.parts:
+            part.close()
+        if self.part is not None:
+            self.part.close()
@@ -0,0 +1,135 @@
+import re
+import threading
+from email.header import decode_header, make_header
+from html import unescape
+from html.parser import HTMLParser
+from utils.tokens import estimate_tokens
+
+# tags whose content is never shown
+SKIP_TAGS = {"script", "style", "head", "title", "noscript", "template"}
+
+# tags that start a new line in the text rendering
+BLOCK_TAGS = {"p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "hr", "section"}
+
+HTML_RE = re.compile(r"<(html|body|div|p|table|br|span|a)\b", re.I)
+
+# first line of a quoted reply chain ("On Mon, 1 Jan 2024, Bob <bob@x.com> wrote:", outlook headers, ...)
+REPLY_HEADER_RE = re.compile(
+    r"^\s*(On .{0,200}wrote:\s*$|-{2,}\s*Original Message\s*-{2,}|_{10,}\s*$|From: .+\n(Sent|Date): )",
+    re.I | re.M,
+)
+
+# start of a forwarded message, its content is what the email is about, not history
+FORWARD_RE = re.compile(r"^\s*-{2,}\s*Forwarded message\s*-{2,}", re.I | re.M)
+
+# signature delimiter (RFC 3676 "-- ") and mobile client footers
+SIGNATURE_RE = re.compile(r"^(-- ?|Sent from my \w+.*|Get Outlook for \w+.*)$", re.I | re.M)
+
+class _TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document, with block elements on their own lines."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+def html_to_text(html):
+    """Converts an HTML body to plain text locally, dropping scripts, styles and markup."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = "".join(parser.parts)
+    except Exception:
+        text = unescape(re.sub(r"<[^>]+>", " ", html))
+    return collapse_whitespace(text)
+
+def collapse_whitespace(text):
+    """Collapses runs of spaces and blank lines."""
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def split_quoted(text):
+    """Splits a body into what the sender wrote and the quoted reply chain; the signature is dropped.
+
+    A forwarded message is kept in the text as it is, only what comes before it is split.
+    """
+    forwarded = ""
+    match = FORWARD_RE.search(text)
+    if match:
+        text, forwarded = text[:match.start()], text[match.start():]
+    chain = ""
+    match = REPLY_HEADER_RE.search(text)
+    if match and match.start() > 0:
+        text, chain = text[:match.start()], text[match.start():]
+    lines = text.splitlines()
+    quoted = [line for line in lines if line.lstrip().startswith(">")]
+    text = "\n".join(line for line in lines if not line.lstrip().startswith(">"))
+    match = SIGNATURE_RE.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    return "\n\n".join(part for part in (text.strip(), forwarded.strip()) if part), "\n".join(quoted + [chain]).strip()
+
+def decode_header_value(value):
+    """Decodes every RFC 2047 fragment of a header, e.g. "=?utf-8?q?caf=C3=A9?= =?utf-8?q?bar?=" --> "café bar"."""
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(str(value))))
+    except (UnicodeDecodeError, LookupError, ValueError):
+        return str(value)
+
+def summarize(text, limit=200):
+    """Extractive summary used when no model is called: the first sentence of the body."""
+    sentence = re.split(r"(?<=[.!?])\s|\n", text.strip(), maxsplit=1)[0]
+    return sentence[:limit]
+
+class EmailNormalizer:
+    """Deterministic pre-processing of fetched emails before they are prompted.
+
+    HTML bodies are converted to text and quoted replies and signatures are stripped, so the model
+    gets a smaller input and never has to echo the body back. The quoted history is kept in the meta
+    ("quoted") for replies whose thread has no summary yet. Token counts before/after are tracked.
+    """
+
+    def __init__(self):
+        self.stats = {"emails": 0, "raw_tokens": 0, "clean_tokens": 0}
+        self.lock = threading.Lock()
+
+    def normalize(self, email_data):
+        body = email_data.get("body") or ""
+        meta = email_data.get("meta") or {}
+        raw_tokens = estimate_tokens({key: value for key, value in email_data.items() if key != "meta"})
+
+        if meta.get("body_type") == "text/html" or HTML_RE.search(body):
+            body = html_to_text(body)
+        body, quoted = split_quoted(collapse_whitespace(body))
+
+        email_data = {
+            **email_data,
+            **{field: decode_header_value(email_data.get(field)) for field in ("to", "from", "cc", "bcc", "subject")},
+            "body": body,
+        }
+        if quoted:
+            email_data["meta"] = {**meta, "quoted": quoted}
+        with self.lock:
+            self.stats["emails"] += 1
+            self.stats["raw_tokens"] += raw_tokens
+            self.stats["clean_tokens"] += estimate_tokens({key: value for key, value in email_data.items() if key != "meta"})
+        return email_data
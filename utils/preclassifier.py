@@ -0,0 +1,153 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from utils.store_emails import load_emails_data
+from utils.normalize import summarize
+from utils.telemetry import metrics
+
+# minimum confidence for a locally assigned tag set, below it the email goes to the model
+PRECLASSIFIER_THRESHOLD = float(os.getenv("PRECLASSIFIER_THRESHOLD", 0.9))
+
+# the statistical model is only trained when there are enough past results
+MIN_TRAINING_EMAILS = 50
+
+# the model is trained on at most this many of the newest past results, training time grows linearly with it
+PRECLASSIFIER_TRAINING_EMAILS = int(os.getenv("PRECLASSIFIER_TRAINING_EMAILS", 1000))
+
+PROMO_RE = re.compile(r"\b(sale|deal|offer|discount|coupon|promo|% off|free shipping|limited time|shop now)\b", re.I)
+INVOICE_NAME_RE = re.compile(r"(invoice|receipt|bill|statement)", re.I)
+BILLING_SENDER_RE = re.compile(r"(billing|invoice|invoices|accounts|payable|receivable)[^@]*@", re.I)
+CALENDAR_UPDATE_RE = re.compile(r"^(updated invitation|invitation updated|rescheduled|canceled event|cancelled event)", re.I)
+WORD_RE = re.compile(r"[a-z][a-z0-9]{1,}")
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+def rule_tags(email_data):
+    """Tags decided from headers and MIME structure alone, as (tags, confidence)."""
+    meta = email_data.get("meta") or {}
+    subject = email_data.get("subject") or ""
+    sender = email_data.get("from") or email_data.get("from_") or ""
+    parts = meta.get("parts") or []
+    content_types = {part["content_type"] for part in parts}
+    filenames = [part["filename"] or "" for part in parts]
+
+    if "text/calendar" in content_types or any(name.lower().endswith(".ics") for name in filenames):
+        if CALENDAR_UPDATE_RE.search(subject):
+            return ["Meeting Update"], 0.95
+        return ["Meeting Invite/Calendar Invite"], 0.95
+
+    invoice_pdfs = [
+        name for part, name in zip(parts, filenames)
+        if (part["content_type"] == "application/pdf" or name.lower().endswith(".pdf")) and INVOICE_NAME_RE.search(name)
+    ]
+    if invoice_pdfs:
+        return ["Invoice"], 0.95 if BILLING_SENDER_RE.search(sender) else 0.9
+
+    precedence = (meta.get("precedence") or "").strip().lower()
+    if meta.get("list_unsubscribe") or precedence in ("bulk", "list", "junk"):
+        if PROMO_RE.search(subject):
+            return ["Promotional / Marketing / Advertisement"], 0.9
+        return ["Newsletter"], 0.9
+
+    return [], 0.0
+
+def features(email_data):
+    """Bag of words of the subject and body, plus the sender domain."""
+    sender = email_data.get("from") or email_data.get("from_") or ""
+    text = f"{email_data.get('subject') or ''} {HTML_TAG_RE.sub(' ', email_data.get('body') or '')}".lower()
+    tokens = Counter(WORD_RE.findall(text))
+    domain = re.search(r"@([\w.-]+)", sender)
+    if domain:
+        tokens[f"from:{domain.group(1).lower()}"] += 1
+    return tokens
+
+class TagModel:
+    """TF-IDF features with one logistic regression per tag, trained on previously parsed emails."""
+
+    def __init__(self, emails, epochs=10, learning_rate=0.5, l2=1e-4):
+        documents = [features(email_data) for email_data in emails]
+        document_frequency = Counter(token for document in documents for token in document)
+        self.idf = {token: math.log(len(documents) / df) + 1 for token, df in document_frequency.items()}
+        vectors = [self.vectorize(document) for document in documents]
+        labels = [set(email_data.get("tags") or []) for email_data in emails]
+        self.tags = sorted(set().union(*labels))
+        self.weights = {tag: {} for tag in self.tags}
+        self.bias = {tag: 0.0 for tag in self.tags}
+
+        for tag in self.tags:
+            weights = self.weights[tag]
+            for _ in range(epochs):
+                for vector, tags in zip(vectors, labels):
+                    error = self._probability(tag, vector) - (1.0 if tag in tags else 0.0)
+                    self.bias[tag] -= learning_rate * error
+                    for token, value in vector.items():
+                        weights[token] = weights.get(token, 0.0) * (1 - learning_rate * l2) - learning_rate * error * value
+
+    def vectorize(self, document):
+        """L2-normalized TF-IDF vector of a bag of words; unseen tokens are dropped."""
+        vector = {token: (1 + math.log(count)) * self.idf[token] for token, count in document.items() if token in self.idf}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {token: value / norm for token, value in vector.items()}
+
+    def _probability(self, tag, vector):
+        weights = self.weights[tag]
+        score = self.bias[tag] + sum(weights.get(token, 0.0) * value for token, value in vector.items())
+        return 1 / (1 + math.exp(-max(min(score, 30), -30)))
+
+    def predict(self, email_data):
+        """Returns (tags, confidence); the confidence is that of the least certain per-tag decision."""
+        vector = self.vectorize(features(email_data))
+        probabilities = {tag: self._probability(tag, vector) for tag in self.tags}
+        tags = [tag for tag, probability in probabilities.items() if probability >= 0.5]
+        confidence = min((max(p, 1 - p) for p in probabilities.values()), default=0.0)
+        return tags, confidence if tags else 0.0
+
+class PreClassifier:
+    """Tags emails locally, with header/MIME rules first and the statistical model second.
+
+    classify() returns the insights (tags, summary) when the tags are confident enough, or None to escalate
+    the email to the model. Its results carry "source": "preclassifier", their extractive summary never
+    becomes a thread summary.
+    """
+
+    def __init__(self, threshold=PRECLASSIFIER_THRESHOLD, training_emails=None):
+        self.threshold = threshold
+        if training_emails is None:
+            # the legacy files only hold model results, appended in order, the newest in the last written files
+            training_emails = load_emails_data(by_mtime=True)[-PRECLASSIFIER_TRAINING_EMAILS:]
+        # its own earlier predictions are never learned again
+        training_emails = [
+            email_data for email_data in training_emails
+            if email_data.get("tags") and email_data.get("source", "model") == "model"
+        ]
+        self.model = TagModel(training_emails) if len(training_emails) >= MIN_TRAINING_EMAILS else None
+        self.stats = {"rules": 0, "model": 0, "escalated": 0}
+        self.lock = threading.Lock()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+        metrics.count("email_preclassifier_total", result=name)
+
+    def classify(self, email_data):
+        tags, confidence = rule_tags(email_data)
+        stage = "rules"
+        if confidence < self.threshold and self.model is not None:
+            tags, confidence = self.model.predict(email_data)
+            stage = "model"
+        if confidence < self.threshold:
+            self._count("escalated")
+            return None
+
+        self._count(stage)
+        return {
+            "tags": tags,
+            "summary": summarize(email_data.get("body") or email_data.get("subject") or ""),
+            "source": "preclassifier",
+        }
+
+    def local_fraction(self):
+        """Fraction of the emails tagged without calling the model."""
+        total = sum(self.stats.values())
+        return (self.stats["rules"] + self.stats["model"]) / total if total else 0.0
@@ -1,7 +1,12 @@
+import ast
 import json
 import os
 import re
+import logging
 from datetime import datetime
+from utils.telemetry import span
+
+logger = logging.getLogger(__name__)
 
 def sanitize_filename(filename):
     """Sanitizes the filename by removing invalid characters."""
@@ -24,51 +29,88 @@ def extract_valid_json(response):
         return json.loads(response)
 
     except json.JSONDecodeError as e:
-        print(f"❌ JSON Parsing Error: {e}")
+        logger.error(f"❌ JSON Parsing Error: {e}")
         return None
     except UnicodeDecodeError as e:
-        print(f"❌ Unicode Decode Error: {e}")
+        logger.error(f"❌ Unicode Decode Error: {e}")
         return None
 
-def store_emails_data(email_data_list):
+def store_emails_data(email_data_list, output_folder="parsed_emails"):
     """Stores email threads into single files based on normalized subject."""
     if isinstance(email_data_list, dict):
         email_data_list = [email_data_list]
 
     if not isinstance(email_data_list, list):
-        print(f"❌ Invalid email data format: {type(email_data_list)}")
+        logger.error(f"❌ Invalid email data format: {type(email_data_list)}")
         return
 
-    output_folder = "parsed_emails"
     os.makedirs(output_folder, exist_ok=True)
 
-    for idx, email_json in enumerate(email_data_list):
-        try:
-            if not isinstance(email_json, dict):
-                raise TypeError(f"Invalid email entry at index {idx}: {type(email_json)}")
-
-            subject = email_json.get("subject", f"No_Subject_{idx+1}")
-            normalized_subject = normalize_subject(subject)
-            sanitized_subject = sanitize_filename(normalized_subject)
-
-            file_path = os.path.join(output_folder, f"{sanitized_subject}.txt")
-
-            body_text = email_json.get("body", "").replace("\n", " ").replace("\r", " ")
-            email_text = (
-                f"To: {email_json.get('to', '')}\n"
-                f"From: {email_json.get('from_', '') or email_json.get('from', '')}\n"
-                f"CC: {email_json.get('cc', 'N/A')}\n"
-                f"BCC: {email_json.get('bcc', 'N/A')}\n"
-                f"Subject: {email_json.get('subject', '')}\n"
-                f"Body:\n{body_text}\n"
-                f"Tags: {email_json.get('tags', '')}\n"
-                f"{'-' * 80}\n"
-            )
+    with span("store", emails=len(email_data_list), target="files"):
+        for idx, email_json in enumerate(email_data_list):
+            try:
+                if not isinstance(email_json, dict):
+                    raise TypeError(f"Invalid email entry at index {idx}: {type(email_json)}")
+
+                subject = email_json.get("subject", f"No_Subject_{idx+1}")
+                normalized_subject = normalize_subject(subject)
+                sanitized_subject = sanitize_filename(normalized_subject)
+
+                file_path = os.path.join(output_folder, f"{sanitized_subject}.txt")
+
+                body_text = email_json.get("body", "").replace("\n", " ").replace("\r", " ")
+                email_text = (
+                    f"To: {email_json.get('to', '')}\n"
+                    f"From: {email_json.get('from_', '') or email_json.get('from', '')}\n"
+                    f"CC: {email_json.get('cc', 'N/A')}\n"
+                    f"BCC: {email_json.get('bcc', 'N/A')}\n"
+                    f"Subject: {email_json.get('subject', '')}\n"
+                    f"Body:\n{body_text}\n"
+                    f"Tags: {email_json.get('tags', '')}\n"
+                    f"{'-' * 80}\n"
+                )
 
-            write_mode = "a" if os.path.exists(file_path) else "w"
-            with open(file_path, write_mode, encoding="utf-8") as f:
-                f.write(email_text)
+                write_mode = "a" if os.path.exists(file_path) else "w"
+                with open(file_path, write_mode, encoding="utf-8") as f:
+                    f.write(email_text)
 
-            print(f"✅ Stored email in: {file_path}")
-        except Exception as e:
-            print(f"❌ Error storing email {idx+1}: {e}")
\ No newline at end of file
+                logger.debug(f"✅ Stored email in: {file_path}")
+            except Exception as e:
+                logger.error(f"❌ Error storing email {idx+1}: {e}")
+
+def load_emails_data(output_folder="parsed_emails", by_mtime=False):
+    """Reads back the emails written by store_emails_data as a list of dicts (body newlines are lost).
+
+    The files are read by name, or with by_mtime from the least to the most recently written, which puts
+    the newest emails last (the records carry no date).
+    """
+    emails = []
+    if not os.path.isdir(output_folder):
+        return emails
+
+    file_names = sorted(os.listdir(output_folder))
+    if by_mtime:
+        file_names.sort(key=lambda file_name: os.path.getmtime(os.path.join(output_folder, file_name)))
+    for file_name in file_names:
+        if not file_name.endswith(".txt"):
+            continue
+        with open(os.path.join(output_folder, file_name), "r", encoding="utf-8") as f:
+            records = f.read().split(f"{'-' * 80}\n")
+
+        for record in records:
+            match = re.search(
+                r"^To: (.*)\nFrom: (.*)\nCC: (.*)\nBCC: (.*)\nSubject: (.*)\nBody:\n(.*)\nTags: (.*)$",
+                record.strip("\n"), re.DOTALL
+            )
+            if not match:
+                continue
+            to, from_, cc, bcc, subject, body, tags = match.groups()
+            try:
+                tags = ast.literal_eval(tags)
+            except (ValueError, SyntaxError):
+                tags = [tag.strip() for tag in tags.split(",") if tag.strip()]
+            emails.append({
+                "to": to, "from_": from_, "cc": cc, "bcc": bcc,
+                "subject": subject, "body": body, "tags": list(tags) if isinstance(tags, (list, tuple)) else [str(tags)]
+            })
+    return emails
@@ -0,0 +1,189 @@
+import imaplib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from imap import connect, env_account, iter_emails, account_key
+
+# JSON list of accounts: [{"user": ..., "password_env": "VAR" or "password": ..., "host": ..., "port": 993, "folders": [...]}]
+IMAP_ACCOUNTS_FILE = os.getenv("IMAP_ACCOUNTS_FILE", "accounts.json")
+
+# open connections allowed per IMAP host, servers throttle or reject above their own limit.
+# the monitoring daemon adds one IDLE connection per watched folder on top of it
+IMAP_CONNECTIONS_PER_HOST = int(os.getenv("IMAP_CONNECTIONS_PER_HOST", 4))
+
+# folders synced at the same time
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", 8))
+
+# processes decoding MIME, 0 decodes on the fetch threads. they are forked at startup, before it is known
+# whether there is new mail, and iter_emails decodes at most IMAP_BODY_LIMIT bytes per message, so few are enough
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", 2))
+
+# an idle connection is checked with a NOOP before reuse after this many seconds
+IDLE_CHECK_SECONDS = 60
+
+# emails buffered between the sync workers and the consumer
+QUEUE_SIZE = 1000
+
+_DONE = object()
+
+def _put(emails, item, stop):
+    """Puts an item in the queue unless the consumer stopped; False when it did."""
+    while not stop.is_set():
+        try:
+            emails.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+logger = logging.getLogger(__name__)
+
+def load_accounts(path=IMAP_ACCOUNTS_FILE):
+    """Reads the monitored accounts and folders, or falls back to the env account with its INBOX."""
+    if not os.path.exists(path):
+        return [{**env_account(), "folders": ["INBOX"]}]
+
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    for account in accounts:
+        if "password_env" in account:
+            account["password"] = os.getenv(account["password_env"])
+        account.setdefault("port", 993 if account.get("ssl", True) else 143)
+        account.setdefault("folders", ["INBOX"])
+    return accounts
+
+class ConnectionPool:
+    """Authenticated IMAP connections kept open and reused across sync cycles, with a per-host limit."""
+
+    def __init__(self, per_host_limit=IMAP_CONNECTIONS_PER_HOST):
+        self.per_host_limit = per_host_limit
+        self.host_slots = {}
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _slots(self, host):
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self.host_slots[host]
+
+    def _checkout(self, account):
+        with self.lock:
+            connections = self.idle.get(account_key(account), [])
+            mail, last_used = connections.pop() if connections else (None, 0)
+        if mail is not None and time.monotonic() - last_used > IDLE_CHECK_SECONDS:
+            try:
+                mail.noop()
+            except Exception:
+                self._logout(mail)
+                mail = None
+        return mail or connect(account)
+
+    @staticmethod
+    def _logout(mail):
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, account):
+        """Lends a logged-in connection to the account; it is dropped instead of reused if the caller fails."""
+        with self._slots(account["host"]):
+            mail = self._checkout(account)
+            try:
+                yield mail
+            except Exception:
+                self._logout(mail)
+                raise
+            with self.lock:
+                self.idle.setdefault(account_key(account), []).append((mail, time.monotonic()))
+
+    def close(self):
+        """Logs out every idle connection."""
+        with self.lock:
+            connections = [mail for idle in self.idle.values() for mail, _ in idle]
+            self.idle = {}
+        for mail in connections:
+            self._logout(mail)
+
+class SyncCoordinator:
+    """Syncs many accounts and folders concurrently, reusing connections from one cycle to the next.
+
+    Each (account, folder) runs iter_emails on a worker thread, MIME decoding runs in a process pool,
+    and the emails of all folders are handed out through one bounded queue as they arrive.
+    """
+
+    def __init__(self, accounts=None, sync_state=None, workers=SYNC_WORKERS, parse_processes=PARSE_PROCESSES,
+                 connections=None):
+        self.accounts = accounts if accounts is not None else load_accounts()
+        self.sync_state = sync_state
+        self.workers = workers
+        self.connections = connections or ConnectionPool()
+        self.parse_pool = None
+        # worker processes are forked before any sync thread exists; other platforms decode on the fetch threads
+        if parse_processes and "fork" in multiprocessing.get_all_start_methods():
+            self.parse_pool = ProcessPoolExecutor(parse_processes, mp_context=multiprocessing.get_context("fork"))
+            self.parse_pool.submit(int).result()
+
+    def _sync_folder(self, account, folder, emails, stop):
+        # a pooled connection may have been dropped by the server, the sync is retried once on a fresh one
+        for attempt in range(2):
+            try:
+                with self.connections.connection(account) as mail:
+                    for email_data in iter_emails(
+                        sync_state=self.sync_state, folder=folder, mail=mail, account=account, parse_pool=self.parse_pool
+                    ):
+                        # leaving iter_emails early records no further high-water mark
+                        if not _put(emails, email_data, stop):
+                            break
+                return
+            except (imaplib.IMAP4.abort, OSError) as e:
+                if attempt == 0:
+                    continue
+                logger.error(f"❌ Error syncing {account_key(account)}/{folder}: {e}")
+            except Exception as e:
+                logger.error(f"❌ Error syncing {account_key(account)}/{folder}: {e}")
+                return
+
+    def iter_emails(self, folders=None):
+        """Runs one sync cycle and yields the new emails as they arrive.
+
+        Every account and folder is synced, or only the (account, folder) pairs passed in folders.
+        When the consumer stops early (close() or an error), the sync threads are stopped before this
+        returns, so the SyncState is no longer changed behind its back.
+        """
+        emails = queue.Queue(maxsize=QUEUE_SIZE)
+        stop = threading.Event()
+        if folders is None:
+            folders = [(account, folder) for account in self.accounts for folder in account["folders"]]
+
+        def run():
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for account, folder in folders:
+                    executor.submit(self._sync_folder, account, folder, emails, stop)
+            _put(emails, _DONE, stop)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                email_data = emails.get()
+                if email_data is _DONE:
+                    return
+                yield email_data
+        finally:
+            stop.set()
+            thread.join()
+
+    def close(self):
+        """Logs out the pooled connections and stops the parse processes."""
+        self.connections.close()
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
@@ -0,0 +1,91 @@
+import copy
+import json
+import logging
+import os
+import threading
+
+SYNC_STATE_FILE = "sync_state.json"
+
+logger = logging.getLogger(__name__)
+
+class SyncState:
+    """Keeps the UIDVALIDITY and last processed UID of every account/folder in a local JSON file.
+
+    An email that failed is retried by holding the mark back below it, up to max_attempts times
+    (SYNC_MAX_ATTEMPTS); then its UID is recorded under "failed" and the mark moves past it.
+    """
+
+    def __init__(self, path=SYNC_STATE_FILE, max_attempts=None):
+        self.path = path
+        self.max_attempts = max_attempts if max_attempts is not None else int(os.getenv("SYNC_MAX_ATTEMPTS", 3))
+        self.state = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    @staticmethod
+    def key(account, folder):
+        """Builds the state key of a folder, e.g. "user@example.com@imap.example.com/INBOX"."""
+        return f"{account}/{folder}"
+
+    def last_uid(self, account, folder, uidvalidity):
+        """Returns the last processed UID, or 0 when the folder is new or its UIDVALIDITY changed (full resync)."""
+        entry = self.state.get(self.key(account, folder))
+        if not entry or entry["uidvalidity"] != int(uidvalidity):
+            return 0
+        return entry["last_uid"]
+
+    def update(self, account, folder, uidvalidity, last_uid):
+        """Moves the high-water mark of a folder forward. Call save() once the emails are processed."""
+        with self.lock:
+            key = self.key(account, folder)
+            entry = self.state.get(key)
+            if not entry or entry["uidvalidity"] != int(uidvalidity):
+                entry = self.state[key] = {"uidvalidity": int(uidvalidity), "last_uid": 0}
+            entry["last_uid"] = max(int(last_uid), entry["last_uid"])
+
+    def hold_back(self, meta):
+        """Moves the high-water mark of a folder back below a failed email (its "meta"), so the next sync fetches it again.
+
+        The emails above it are fetched again too; the LLM cache and the upserts of the store make that cheap.
+        After max_attempts failures the email is given up on, so it can not hold the mark back forever.
+        """
+        if meta.get("uid") is None or meta.get("account") is None:
+            return
+        with self.lock:
+            key = self.key(meta["account"], meta["folder"])
+            entry = self.state.get(key)
+            if not entry or entry["uidvalidity"] != int(meta["uidvalidity"]):
+                return
+            uid = int(meta["uid"])
+            attempts = entry.setdefault("attempts", {})
+            attempts[str(uid)] = attempts.get(str(uid), 0) + 1
+            if attempts[str(uid)] >= self.max_attempts:
+                del attempts[str(uid)]
+                entry.setdefault("failed", []).append(uid)
+                logger.warning(f"❌ Giving up on UID {uid} of {key} after {self.max_attempts} attempts")
+                return
+            entry["last_uid"] = min(entry["last_uid"], uid - 1)
+
+    def snapshot(self):
+        """A copy of the state, to restore() when a sync cycle fails before its emails are stored."""
+        with self.lock:
+            return copy.deepcopy(self.state)
+
+    def restore(self, snapshot):
+        """Goes back to a snapshot(), forgetting the marks moved since."""
+        with self.lock:
+            self.state = copy.deepcopy(snapshot)
+
+    def save(self):
+        """Writes the state atomically so an interrupted run never leaves a truncated file behind."""
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            # the attempts of emails below the mark are over, they succeeded
+            for entry in self.state.values():
+                if "attempts" in entry:
+                    entry["attempts"] = {uid: count for uid, count in entry["attempts"].items() if int(uid) > entry["last_uid"]}
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
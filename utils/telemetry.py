@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the settings below are read when they are used, not at import, so a .env loaded by the entry point counts
+
+# upper bounds of the stage duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed as extra={"fields": {...}}."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def setup_logging(level=None, log_format=None):
+    """Sends the logs of the pipeline to stderr, as plain messages or JSON lines."""
+    if level is None:
+        # log level of the pipeline, DEBUG adds every span and the email payloads
+        level = os.getenv("LOG_LEVEL", "INFO")
+    if log_format is None:
+        # "json" writes one JSON object per log line (with the span fields), "text" only the message
+        log_format = os.getenv("LOG_FORMAT", "text")
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    # the gemini and ollama clients log every HTTP request at INFO
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+class Metrics:
+    """Thread-safe counters and duration histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """Adds value to a counter, e.g. count("email_llm_retries_total")."""
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Records a duration in a histogram."""
+        key = (name, _labels(labels))
+        with self.lock:
+            buckets, total = self.histograms.get(key, ([0] * len(DURATION_BUCKETS), [0.0, 0]))
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            total[0] += seconds
+            total[1] += 1
+            self.histograms[key] = (buckets, total)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, (seconds, count)) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, bucket in zip(DURATION_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {bucket}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {seconds:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=None):
+        """Writes the metrics file atomically, so a scraper never reads half of it."""
+        if path is None:
+            # Prometheus text file, e.g. for the node_exporter textfile collector
+            path = os.getenv("METRICS_FILE", "metrics.prom")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port=None, host=None):
+        """Serves the metrics on http://host:port/metrics from a background thread, None when the port is 0."""
+        if port is None:
+            # port of the /metrics endpoint, 0 disables it
+            port = int(os.getenv("METRICS_PORT", 0))
+        if host is None:
+            # "0.0.0.0" exposes the account/folder labels on every interface
+            host = os.getenv("METRICS_HOST", "127.0.0.1")
+        if not port:
+            return None
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"✅ Metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+# metrics of the whole process
+metrics = Metrics()
+
+def record_span(stage, seconds, status="ok", emails=None, **labels):
+    """Records a finished stage: its duration, errors and emails, and a DEBUG log line with the span fields."""
+    metrics.observe("email_pipeline_stage_seconds", seconds, stage=stage, **labels)
+    if status != "ok":
+        metrics.count("email_pipeline_stage_errors_total", stage=stage, **labels)
+    if emails:
+        metrics.count("email_pipeline_stage_emails_total", emails, stage=stage, **labels)
+    if logger.isEnabledFor(logging.DEBUG):
+        fields = {"span": stage, "seconds": round(seconds, 6), "status": status, "emails": emails, **labels}
+        logger.debug(f"span {stage} {seconds * 1000:.1f} ms", extra={"fields": fields})
+
+@contextmanager
+def span(stage, emails=None, **labels):
+    """Times a pipeline stage (fetch, decode, prompt, model, validate, store) with record_span."""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record_span(stage, time.perf_counter() - start, status, emails, **labels)
@@ -0,0 +1,8 @@
+import math
+
+# average characters per token of the gemini/gemma tokenizers on english email text
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Estimates the number of tokens of a text without loading a tokenizer."""
+    return math.ceil(len(str(text)) / CHARS_PER_TOKEN)